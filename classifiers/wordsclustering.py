@@ -4,28 +4,27 @@ from sklearn.metrics import confusion_matrix, f1_score
 from pprint import pprint
 
 class NaiveBayesCluster():
-    def __init__(self, clusters, Ndw, words):
+    def __init__(self, clusters, Ndw, categories):
+        # Ndw gives the number of occurrences of each word in each document
+        # (documents x words) and categories the category of each document
         self.clusters = clusters
         self.Ndw = Ndw
-        self.words = words
+        self.categories = np.asarray(categories)
         self.LABELS = [1,0]
         self._prepare()
 
     def evaluate(self, documents):
-        predictions = []
+        predictions = np.argmax(self.log_probas(documents), axis=1)
+        return [int(prediction) for prediction in predictions]
 
-        n_cats = len(self.Ndw)
-        for doc in documents:
-            cat_probas = np.ones(n_cats)
-            for cat in range(n_cats):
-                for cluster in doc['converted']:
-                    cat_probas[cat] *= self.Pcluster_c[cluster, cat]
-                cat_probas[cat] *= self.Pc[cat]
-            prediction = np.argwhere(cat_probas == cat_probas.max())
-            # print(prediction)
-            prediction = prediction[0]
-            predictions.append(int(prediction))
-        return predictions
+    def log_probas(self, documents):
+        # Log-probability of each category for each document (documents x
+        # categories), summed in log-space so that it does not vanish with
+        # many clusters
+        log_probas = np.zeros((len(documents), len(self.Pc)))
+        for d, doc in enumerate(documents):
+            log_probas[d] = self.log_Pcluster_c[list(doc['converted'])].sum(axis=0) + self.log_Pc
+        return log_probas
 
     def score(self, y_true, y_pred):
         tn, fp, fn, tp = confusion_matrix(y_true, y_pred).ravel()
@@ -40,43 +39,33 @@ class NaiveBayesCluster():
 
 
     def _prepare(self):
-        n_cats = len(self.Ndw)
+        # Categories in order of first appearance
+        names = list(dict.fromkeys(self.categories.tolist()))
+        self.names = names
+        n_cats = len(names)
         n_clusters = len(self.clusters)
 
+        # Cluster of each word
+        word_clusters = np.full(self.Ndw.shape[1], -1)
+        for cluster in range(n_clusters):
+            word_clusters[self.clusters[cluster]] = cluster
+        clustered = word_clusters >= 0
+
         self.Nc_cluster = np.zeros((n_cats, n_clusters))
-        self._fill_Nc_cluster(n_clusters)
+        for cat, name in enumerate(names):
+            Ncw = np.asarray(self.Ndw[np.flatnonzero(self.categories == name)].sum(axis=0)).ravel()
+            self.Nc_cluster[cat] = np.bincount(word_clusters[clustered], weights=Ncw[clustered], minlength=n_clusters)
         self.Nc_cluster = self.Nc_cluster + 0.5
         self.total_ncw = [sum(x) for x in self.Nc_cluster]
 
-        self.Pc = self._fill_Pc()
-
-        self.Pcluster_c = np.zeros((n_clusters, n_cats))
-        self._fill_Pcluster_c(n_clusters, n_cats)
+        self.Pc = self._fill_Pc(names)
 
-    def _fill_Pcluster_c(self, n_clusters, n_cats):
-        for cluster in range(n_clusters):
-            for cat in range(n_cats):
-                self.Pcluster_c[cluster, cat] = self.Nc_cluster[cat, cluster] / self.total_ncw[cat]
+        self.Pcluster_c = (self.Nc_cluster / np.array(self.total_ncw)[:, np.newaxis]).T
+        self.log_Pcluster_c = np.log(self.Pcluster_c)
+        self.log_Pc = np.log(self.Pc)
 
-    def _fill_Pc(self):
+    def _fill_Pc(self, names):
         pc = []
-        for cat in self.Ndw:
-            pc.append(len(self.Ndw[cat]))
+        for name in names:
+            pc.append(np.count_nonzero(self.categories == name))
         return np.array(pc)/sum(np.array(pc))
-
-    def _fill_Nc_cluster(self, n_clusters):
-        id_cat = -1
-        for cat in self.Ndw:
-            id_cat += 1
-            for cluster in range(n_clusters):
-                total = 0
-                for doc in self.Ndw[cat]:
-                    for w in self.clusters[cluster]:
-                        word = self.words[w]
-                        total += self._from_Ndw(cat, doc, word)
-                self.Nc_cluster[id_cat, cluster] = total
-
-    def _from_Ndw(self, cat, doc, word):
-        if word in self.Ndw[cat][doc]:
-            return self.Ndw[cat][doc][word]
-        return 0
@@ -1,118 +1,239 @@
 import numpy as np
-import pandas as pd
+
+from collections import deque
+from scipy import sparse
 
 import explorer_helper as exh
 import plotter as plt
 
+class WordsDistribution:
+    def __init__(self, filenames):
+        import pandas as pd
+
+        grams = []
+        c1_weights = []
+        c2_weights = []
+        diff = []
+        for filename in filenames:
+            df = pd.read_csv(filename, sep=',',engine='python')
+            grams.append(df['N-gram'].values.astype(str))
+            c1_weights.append(df['% DIDA'].values.astype(float))
+            c2_weights.append(df['% NotDIDA'].values.astype(float))
+            diff.append(df['Diff'].values.astype(float))
+
+        self._sort(np.concatenate(grams), np.concatenate(c1_weights), np.concatenate(c2_weights), np.concatenate(diff))
+
+    @classmethod
+    def from_weights(cls, grams, c1_weights, c2_weights):
+        # Distribution computed in memory (e.g. on a training split) instead
+        # of being loaded from the CSV files
+        distribution = cls.__new__(cls)
+        distribution._sort(np.asarray(grams, dtype=str), np.asarray(c1_weights, dtype=float),
+            np.asarray(c2_weights, dtype=float), np.asarray(c1_weights, dtype=float) - c2_weights)
+        return distribution
+
+    def _sort(self, grams, c1_weights, c2_weights, diff):
+        # N-grams sorted by decreasing |Diff|, so the n-grams above any
+        # threshold are a prefix of the arrays
+        self.order = np.argsort(-np.abs(diff), kind='mergesort')
+
+        self.grams = grams[self.order]
+        self.c1_weights = c1_weights[self.order]
+        self.c2_weights = c2_weights[self.order]
+        self.diff = diff[self.order]
+        self.abs_diff = np.abs(self.diff)
+        self.index = None
+
+    def presence_matrix(self, documents):
+        # Sparse matrix telling which n-grams of the distribution are present
+        # in each document, the columns following the order of the arrays
+        if self.index is None:
+            self.index = {gram: i for i, gram in enumerate(self.grams)}
+
+        rows = []
+        cols = []
+        for i, doc in enumerate(documents):
+            found = set()
+            for n in doc['grams']:
+                for gram in doc['grams'][n]:
+                    col = self.index.get('(' + ', '.join(gram) + ')')
+                    if col is not None:
+                        found.add(col)
+            rows.extend([i] * len(found))
+            cols.extend(found)
+
+        data = np.ones(len(cols))
+        return sparse.csr_matrix((data, (rows, cols)), shape=(len(documents), len(self.grams)))
+
+    def size(self, threshold):
+        return int(np.searchsorted(-self.abs_diff, -threshold, side='right'))
+
+class NGramMatcher:
+    # Aho-Corasick automaton over token ids finding the n-grams of a list in a
+    # cleaned text with a single scan of its tokens
+    def __init__(self, grams):
+        self.token_ids = dict()
+        self.goto = [dict()]
+        self.outputs = [[]]
+
+        for col, gram in enumerate(grams):
+            state = 0
+            for token in gram[1:-1].split(', '):
+                token_id = self.token_ids.setdefault(token, len(self.token_ids))
+                if not token_id in self.goto[state]:
+                    self.goto[state][token_id] = len(self.goto)
+                    self.goto.append(dict())
+                    self.outputs.append([])
+                state = self.goto[state][token_id]
+            self.outputs[state].append(col)
+
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token_id, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and not token_id in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(token_id, 0) if state else 0
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def find(self, text):
+        found = set()
+        state = 0
+        for token in text.split():
+            token_id = self.token_ids.get(token)
+            if token_id is None: # No n-gram contains this token
+                state = 0
+                continue
+            while state and not token_id in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token_id, 0)
+            found.update(self.outputs[state])
+        return found
+
 class WordsDistributionClassifier:
-    def __init__(self, threshold, filenames, c1, c2, foldername):
+    def __init__(self, threshold, distribution, c1, c2, foldername):
         self.threshold = threshold/100
-        self.ngrams_files = filenames
+        self.distribution = distribution
         self.c1 = c1
         self.c2 = c2
         self.foldername = "wordsdistribution/" + foldername
-        exh.create_directory(self.foldername)
 
-        self.c1_grams = []
-        self.c1_weight_grams = dict()
-        self.c2_grams = []
-        self.c2_weight_grams = dict()
-        self.global_weights = dict()
-        self.global_weights[self.c1] = dict()
-        self.global_weights[self.c2] = dict()
+        self.n_grams = distribution.size(self.threshold)
+        self.matcher = None
 
-        self._prepare_ngrams()
+    def predict(self, documents, with_plot=False, plot_pool=None, plot_pages=False):
+        presence = self.distribution.presence_matrix(documents)
 
-    def _prepare_ngrams(self):
-        for filename in self.ngrams_files:
-            df = pd.read_csv(filename, sep=',',engine='python')
-            for index, row in df.iterrows():
-                if abs(row['Diff']) >= self.threshold:
-                    if row['Diff'] > 0: # n-gram of DIDA
-                        self.c1_grams.append(row['N-gram'])
-                        self.c1_weight_grams[row['N-gram']] = row['% DIDA']
-                    else:
-                        self.c2_grams.append(row['N-gram'])
-                        self.c2_weight_grams[row['N-gram']] = row['% NotDIDA']
-                    self.global_weights[self.c1][row['N-gram']] = row['% DIDA']
-                    self.global_weights[self.c2][row['N-gram']] = row['% NotDIDA']
-
-    def predict(self, documents, with_plot=False):
-        classes = []
-        for doc in documents:
-            c1 = self._count_occurences(doc['grams'], self.c1_grams, self.c1_weight_grams, self.global_weights[self.c1])
-            c2 = self._count_occurences(doc['grams'], self.c2_grams, self.c2_weight_grams, self.global_weights[self.c2])
-
-            if with_plot:
-                filename = self.foldername + '/' + doc['pmid'] + '.png'
-                plt.plot(filename, doc['pmid'], c1, c2, len(self.c1_grams), len(self.c2_grams), "DIDA", "NotDIDA", "Number of n-grams")
-
-            if c1 >= c2:
-                classes.append(1)
+        if with_plot:
+            # The plots are drawn by a pool of background processes: if no
+            # pool is given, a temporary one is created and waited for,
+            # otherwise the caller has to wait for the given pool
+            c1_scores, c2_scores = self.scores(presence)
+            if plot_pool is None:
+                with plt.PlotPool("DIDA", "NotDIDA", "Number of n-grams") as pool:
+                    self.plot(documents, c1_scores, c2_scores, pool, plot_pages)
             else:
-                classes.append(0)
-
-        return np.array(classes)
+                self.plot(documents, c1_scores, c2_scores, plot_pool, plot_pages)
+
+        return self.predict_matrix(presence)
+
+    def plot(self, documents, c1_scores, c2_scores, pool, pages=False):
+        # One PNG file per document, or a single PDF file with one page per
+        # document
+        if pages:
+            exh.create_directory("wordsdistribution")
+            jobs = [(doc['pmid'], c1, c2) for doc, c1, c2 in zip(documents, c1_scores, c2_scores)]
+            pool.plot_pages(self.foldername + '.pdf', jobs)
+        else:
+            exh.create_directory(self.foldername)
+            jobs = [(self.foldername + '/' + doc['pmid'] + '.png', doc['pmid'], c1, c2)
+                for doc, c1, c2 in zip(documents, c1_scores, c2_scores)]
+            pool.plot(jobs)
+
+    def cumulative_scores(self, presence, thresholds):
+        # Scores of each document for each threshold (in decreasing order and
+        # not below the threshold of the classifier) in a single pass: the
+        # n-grams are grouped by the first threshold selecting them, and the
+        # scores of the groups are summed cumulatively
+        sizes = [self.distribution.size(threshold/100) for threshold in thresholds]
+        n_grams = sizes[-1]
+        groups = np.searchsorted(sizes, np.arange(n_grams), side='right')
+
+        c1_weights, c2_weights = self.weight_vectors()
+        shape = (len(self.distribution.grams), len(thresholds))
+        c1_groups = sparse.csr_matrix((c1_weights[:n_grams], (np.arange(n_grams), groups)), shape=shape)
+        c2_groups = sparse.csr_matrix((c2_weights[:n_grams], (np.arange(n_grams), groups)), shape=shape)
+
+        c1_scores = presence.dot(c1_groups).toarray().cumsum(axis=1)
+        c2_scores = presence.dot(c2_groups).toarray().cumsum(axis=1)
+        return c1_scores, c2_scores
+
+    def predict_texts(self, texts):
+        # Predicts the class of cleaned texts (see pubmed_helper.clean_text)
+        # without extracting their n-grams
+        return self.predict_matrix(self.text_presence_matrix(texts))
+
+    def text_presence_matrix(self, texts):
+        if self.matcher is None:
+            self.matcher = NGramMatcher(self.distribution.grams[:self.n_grams])
+
+        rows = []
+        cols = []
+        for i, text in enumerate(texts):
+            found = self.matcher.find(text)
+            rows.extend([i] * len(found))
+            cols.extend(found)
+
+        data = np.ones(len(cols))
+        return sparse.csr_matrix((data, (rows, cols)), shape=(len(texts), len(self.distribution.grams)))
+
+    def predict_matrix(self, presence):
+        c1_scores, c2_scores = self.scores(presence)
+        return (c1_scores >= c2_scores).astype(int)
+
+    def scores(self, presence):
+        c1_weights, c2_weights = self.weight_vectors()
+        return presence.dot(c1_weights), presence.dot(c2_weights)
+
+    def weight_vectors(self):
+        # Weights of all the n-grams of the distribution for each class, 0 for
+        # the n-grams below the threshold or belonging to the other class
+        c1_grams = self.distribution.diff[:self.n_grams] > 0 # n-grams of DIDA
+        c1_weights, c2_weights = self._weights()
+
+        c1_vector = np.zeros(len(self.distribution.grams))
+        c1_vector[:self.n_grams] = np.where(c1_grams, c1_weights, 0)
+        c2_vector = np.zeros(len(self.distribution.grams))
+        c2_vector[:self.n_grams] = np.where(c1_grams, 0, c2_weights)
+
+        return c1_vector, c2_vector
 
 class StrictClassifier(WordsDistributionClassifier):
-    def __init__(self, threshold, filenames, c1, c2):
-        super(StrictClassifier, self).__init__(threshold, filenames, c1, c2, "strict")
-
-    def _count_occurences(self, grams, grams_c, weights, global_weights):
-        counter = 0
-        for g in grams_c:
-            has_found = False
-            for n in grams:
-                for gram in grams[n]:
-                    l_words = list(gram)
-                    words = '(' + ', '.join(l_words) + ')'
-                    if words == g:
-                        counter += 1
-                        has_found = True
-                        break
-                if has_found:
-                    break
-
-        return counter
+    def __init__(self, threshold, distribution, c1, c2):
+        super(StrictClassifier, self).__init__(threshold, distribution, c1, c2, "strict")
+
+    def _weights(self):
+        ones = np.ones(self.n_grams)
+        return ones, ones
 
 class SplitWeightedClassifier(WordsDistributionClassifier):
-    def __init__(self, threshold, filenames, c1, c2):
-        super(SplitWeightedClassifier, self).__init__(threshold, filenames, c1, c2, "splitweighted")
-
-    def _count_occurences(self, grams, grams_c, weights, global_weights):
-        counter = 0
-        for g in grams_c:
-            has_found = False
-            for n in grams:
-                for gram in grams[n]:
-                    l_words = list(gram)
-                    words = '(' + ', '.join(l_words) + ')'
-                    if words == g:
-                        counter += weights[g]
-                        has_found = True
-                        break
-                if has_found:
-                    break
-
-        return counter
+    def __init__(self, threshold, distribution, c1, c2):
+        super(SplitWeightedClassifier, self).__init__(threshold, distribution, c1, c2, "splitweighted")
+
+    def _weights(self):
+        # Each n-gram is weighted by its ratio in the class it belongs to
+        return self.distribution.c1_weights[:self.n_grams], self.distribution.c2_weights[:self.n_grams]
 
 class WeightedClassifier(WordsDistributionClassifier):
-    def __init__(self, threshold, filenames, c1, c2):
-        super(WeightedClassifier, self).__init__(threshold, filenames, c1, c2, "weighted")
-
-    def _count_occurences(self, grams, grams_c, weights, global_weights):
-        counter = 0
-        for g in grams_c:
-            has_found = False
-            for n in grams:
-                for gram in grams[n]:
-                    l_words = list(gram)
-                    words = '(' + ', '.join(l_words) + ')'
-                    if words == g:
-                        counter += global_weights[g]
-                        has_found = True
-                        break
-                if has_found:
-                    break
-
-        return counter
+    def __init__(self, threshold, distribution, c1, c2):
+        super(WeightedClassifier, self).__init__(threshold, distribution, c1, c2, "weighted")
+
+    def _weights(self):
+        # Each n-gram is weighted by its global ratio in each class
+        return self.distribution.c1_weights[:self.n_grams], self.distribution.c2_weights[:self.n_grams]
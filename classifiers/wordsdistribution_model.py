@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+MODEL_FILENAME = "model.json"
+HASHES_FILENAME = "hashes.npy"
+C1_WEIGHTS_FILENAME = "c1_weights.npy"
+C2_WEIGHTS_FILENAME = "c2_weights.npy"
+
+def gram_hash(tokens):
+    # Stable 64 bits hash of the tokens of a n-gram
+    key = ' '.join(tokens).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+def export_model(classifier, directory, metadata=None):
+    # Saves the n-grams selected by a words distribution classifier as sorted
+    # hashes with the weights of each class
+    os.makedirs(directory, exist_ok=True)
+
+    n_grams = classifier.n_grams
+    grams = classifier.distribution.grams[:n_grams]
+    c1_weights, c2_weights = classifier.weight_vectors()
+
+    hashes = np.array([gram_hash(gram[1:-1].split(', ')) for gram in grams], dtype=np.uint64)
+    order = np.argsort(hashes, kind='mergesort')
+    hashes = hashes[order]
+    if np.any(hashes[1:] == hashes[:-1]):
+        raise ValueError("Hash collision between two n-grams of the model")
+
+    max_n = max([len(gram[1:-1].split(', ')) for gram in grams]) if n_grams > 0 else 0
+
+    np.save(os.path.join(directory, HASHES_FILENAME), hashes)
+    np.save(os.path.join(directory, C1_WEIGHTS_FILENAME), c1_weights[:n_grams][order])
+    np.save(os.path.join(directory, C2_WEIGHTS_FILENAME), c2_weights[:n_grams][order])
+
+    model = dict()
+    model['classifier'] = type(classifier).__name__
+    model['threshold'] = classifier.threshold * 100
+    model['c1'] = classifier.c1
+    model['c2'] = classifier.c2
+    model['n_grams'] = int(n_grams)
+    model['max_n'] = int(max_n)
+    model['metadata'] = metadata if metadata is not None else dict()
+    with open(os.path.join(directory, MODEL_FILENAME), 'w') as fp:
+        json.dump(model, fp)
+
+def load_model(directory):
+    return CompactClassifier(directory)
+
+class CompactClassifier:
+    # Words distribution classifier loaded from an exported model, the arrays
+    # being memory-mapped
+    def __init__(self, directory):
+        with open(os.path.join(directory, MODEL_FILENAME), 'r') as fp:
+            model = json.load(fp)
+
+        self.name = model['classifier']
+        self.threshold = model['threshold']
+        self.c1 = model['c1']
+        self.c2 = model['c2']
+        self.max_n = model['max_n']
+        self.metadata = model['metadata']
+
+        self.hashes = np.load(os.path.join(directory, HASHES_FILENAME), mmap_mode='r')
+        self.c1_weights = np.load(os.path.join(directory, C1_WEIGHTS_FILENAME), mmap_mode='r')
+        self.c2_weights = np.load(os.path.join(directory, C2_WEIGHTS_FILENAME), mmap_mode='r')
+
+    def predict(self, documents):
+        return self.predict_texts([doc['text'] for doc in documents])
+
+    def predict_texts(self, texts):
+        c1_scores, c2_scores = self.scores(texts)
+        return (c1_scores >= c2_scores).astype(int)
+
+    def scores(self, texts):
+        c1_scores = np.zeros(len(texts))
+        c2_scores = np.zeros(len(texts))
+        for i, text in enumerate(texts):
+            found = self._find(text)
+            c1_scores[i] = self.c1_weights[found].sum()
+            c2_scores[i] = self.c2_weights[found].sum()
+        return c1_scores, c2_scores
+
+    def _find(self, text):
+        # Indexes of the n-grams of the model present in a cleaned text
+        tokens = text.split()
+        hashes = set()
+        for n in range(1, self.max_n + 1):
+            for i in range(len(tokens) - n + 1):
+                hashes.add(gram_hash(tokens[i:i+n]))
+
+        if len(hashes) == 0 or len(self.hashes) == 0:
+            return np.zeros(0, dtype=np.intp)
+
+        hashes = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        positions = np.searchsorted(self.hashes, hashes)
+        positions[positions == len(self.hashes)] = 0
+        return np.sort(positions[self.hashes[positions] == hashes])
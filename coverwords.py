@@ -8,12 +8,17 @@ The maximum length of studied n-grams can be configured in the configuration
 file.
 
 The script can be run through the following command :
-`python coverwords.py CONFIG`
+`python coverwords.py CONFIG [--processes P] [--sweep TETA [TETA ...]]`
 where `CONFIG` is the name of the configuration file situated in the `config`
-folder (without the extension).
+folder (without the extension), `P` is the number of processes used to
+analyze each class and each length of n-grams in parallel and `TETA` are the
+values of the threshold to evaluate in a single run instead of the one of the
+configuration file.
 """
 
 import argparse
+import multiprocessing
+import os
 import sys
 
 import numpy as np
@@ -26,6 +31,7 @@ import ngrams_helper as ngh
 import plotter as plt
 
 CONFIG = None
+DOCUMENTS = dict()
 
 DIRECTORY = "coverwords"
 FILENAME_TEMPLATE = "documents/{0}.json"
@@ -34,6 +40,8 @@ FIGURE_NAME = "{0} - {1}-grams"
 FIG_FILENAME = DIRECTORY + "/all_{0}grams_{1}.png"
 SET_COVER_FILENAME = DIRECTORY + "/set_cover_{0}_{1}grams.json"
 SCORE_FILENAME = DIRECTORY + "/score_set_cover_{0}_{1}grams.txt"
+SWEEP_SCORE_FILENAME = DIRECTORY + "/score_set_cover_{0}_{1}grams_teta{2}.txt"
+SWEEP_SUMMARY_FILENAME = DIRECTORY + "/sweep_{0}_{1}grams.csv"
 TOPWORDS_FILENAME = DIRECTORY + "/topwords.json"
 
 
@@ -56,6 +64,12 @@ def check_args(argv):
     parser = argparse.ArgumentParser(description="Searches the top words in a\
         publications file")
     parser.add_argument('CONFIG', type=str, help="the name of the configuration file (without extension)")
+    parser.add_argument('-p', '--processes', type=int, default=None, help="the \
+        number of processes used to analyze the classes and n-grams lengths \
+        (default : number of CPUs)")
+    parser.add_argument('--sweep', type=float, nargs='+', default=None,
+        metavar='TETA', help="solves the set cover for each given value of \
+        TETA_COVERWORDS instead of the value of the configuration file")
     args = parser.parse_args()
 
     return args
@@ -88,19 +102,10 @@ def check_score(set_cover, subsets, sets, objects):
     n_sets = len(sets)
     n_obj = len(objects)
 
-    tot_covered_objs = []
-    for subset in subsets:
-        for obj in subset[3]:
-            if not obj in tot_covered_objs:
-                tot_covered_objs.append(obj)
-    n_tot_covered_objs = len(tot_covered_objs)
+    pmid_ids = index_pmids(objects)
 
-    covered_objs = []
-    for set in set_cover:
-        for obj in set[3]:
-            if not obj in covered_objs:
-                covered_objs.append(obj)
-    n_covered_objs = len(covered_objs)
+    n_tot_covered_objs = np.count_nonzero(covered_pmids(subsets, pmid_ids))
+    n_covered_objs = np.count_nonzero(covered_pmids(set_cover, pmid_ids))
 
     scores = "Total number of n-grams : " + str(n_sets) + "\n" \
     + "Number of n-grams above the threshold : " + str(n_subsets) + "\n" \
@@ -123,6 +128,28 @@ def check_score(set_cover, subsets, sets, objects):
 
     return scores
 
+def covered_pmids(grams, pmid_ids):
+    """Marks the documents covered by at least one n-gram of a list
+
+    Parameters
+    ----------
+    grams : list
+        The list of occurrences as returned by
+        ngrams_helper.normalize_occurences
+    pmid_ids : dict
+        The dense integer id of each PMID as returned by index_pmids
+
+    Returns
+    -------
+    numpy.ndarray
+        boolean array in which the i-th value tells if the document having the
+        id i is covered
+    """
+    covered = np.zeros(len(pmid_ids), dtype=bool)
+    for gram in grams:
+        covered[gram_pmids(gram, pmid_ids)] = True
+    return covered
+
 def filter(occurrences):
     """Filters the n-grams to keep only the most relevant ones
 
@@ -175,20 +202,36 @@ def find_set_cover(grams, docs):
     docs : list
         The documents to cover
     """
-    pmids = []
-    covered_pmids = []
-    for doc in docs:
-        pmids.append(doc['pmid'])
-        covered_pmids.append(False)
+    pmid_ids = index_pmids(docs)
+    covered = np.zeros(len(pmid_ids), dtype=bool)
+    n_uncovered = len(pmid_ids)
 
     for i, gram in enumerate(grams):
-        for pmid in gram[3]:
-            index = pmids.index(pmid)
-            covered_pmids[index] = True # Mark the document
-            gram = (gram[0], gram[1], gram[2], gram[3], True) # Mark the n-gram
-            grams[i] = gram
-        if not False in covered_pmids: # All documents are covered
+        if n_uncovered == 0: # All documents are covered
             break
+        if len(gram[3]) == 0:
+            continue
+        ids = gram_pmids(gram, pmid_ids)
+        n_uncovered -= np.count_nonzero(~covered[ids])
+        covered[ids] = True # Mark the documents
+        grams[i] = (gram[0], gram[1], gram[2], gram[3], True) # Mark the n-gram
+
+def gram_pmids(gram, pmid_ids):
+    """Gives the ids of the documents covered by a n-gram
+
+    Parameters
+    ----------
+    gram : tuple
+        An occurrence as returned by ngrams_helper.normalize_occurences
+    pmid_ids : dict
+        The dense integer id of each PMID as returned by index_pmids
+
+    Returns
+    -------
+    numpy.ndarray
+        the ids of the covered documents
+    """
+    return np.fromiter((pmid_ids[pmid] for pmid in gram[3]), dtype=np.intp, count=len(gram[3]))
 
 def get_set_cover(occurrences):
     """Solves the Minimum Set Cover problem with n-grams as collections and
@@ -204,39 +247,68 @@ def get_set_cover(occurrences):
     list
         the n-grams having a documents coverage greater than the threshold
     """
-    pmids = []
-    t = 0
+    pmid_ids = dict()
     for gram in occurrences:
         for pmid in gram[3]:
-            if not pmid in pmids:
-                pmids.append(pmid)
+            if not pmid in pmid_ids:
+                pmid_ids[pmid] = len(pmid_ids)
 
-    ncols = len(occurrences)
-    mrows = len(pmids)
+    relationship_matrix = get_relationship_matrix(occurrences, pmid_ids)
+    solution = solve_set_cover(relationship_matrix)
 
-    relationship_matrix = np.zeros(shape=(mrows, ncols), dtype=bool)
-    cost = np.ones(ncols)
+    cover = []
+    for i in np.flatnonzero(solution):
+        cover.append(occurrences[i])
 
-    for row in range(mrows):
-        for col in range(ncols):
-            if pmids[row] in occurrences[col][3]:
-                relationship_matrix[row, col] = True
+    return cover
 
-    g = setcover.SetCover(relationship_matrix, cost)
-    display.disable_print()
-    solution, time_used = g.SolveSCP()
-    display.enable_print()
+def get_relationship_matrix(occurrences, pmid_ids):
+    """Builds the matrix telling which documents are covered by each n-gram
 
-    cover = []
-    for i in range(ncols):
-        if g.s[i]:
-            cover.append(occurrences[i])
+    Parameters
+    ----------
+    occurrences : list
+        The collections of documents
+    pmid_ids : dict
+        The dense integer id of each PMID as returned by index_pmids
 
-    return cover
+    Returns
+    -------
+    numpy.ndarray
+        boolean matrix in which the value at row i and column j tells if the
+        document having the id i is covered by the j-th n-gram
+    """
+    relationship_matrix = np.zeros(shape=(len(pmid_ids), len(occurrences)), dtype=bool)
+    for col, gram in enumerate(occurrences):
+        relationship_matrix[gram_pmids(gram, pmid_ids), col] = True
+    return relationship_matrix
+
+def index_pmids(docs):
+    """Maps the PMID of each document to a dense integer id
+
+    Parameters
+    ----------
+    docs : list
+        The documents to index
+
+    Returns
+    -------
+    dict
+        the id of each PMID, between 0 and the number of distinct PMIDs
+    """
+    pmid_ids = dict()
+    for doc in docs:
+        if not doc['pmid'] in pmid_ids:
+            pmid_ids[doc['pmid']] = len(pmid_ids)
+    return pmid_ids
 
 def plot(occurrences, data_class, n):
     """Plots the n-grams and their coverage
 
+    When there are more n-grams than the PLOT_DENSITY_LIMIT field of the
+    config file, the n-grams are drawn as a density map on which only the
+    marked n-grams are drawn as dots.
+
     Parameters
     ----------
     occurrences : list
@@ -247,9 +319,23 @@ def plot(occurrences, data_class, n):
     n : int
         The length of the n-grams
     """
+    threshold = occurrences[0][1] * CONFIG['TETA_COVERWORDS']
+    colors = ["red", "blue"]
+    threshold_color = "green"
+    xlabel = "Number of occurences"
+    ylabel = "Covered publications"
+    figname = FIGURE_NAME.format(data_class.upper(), n)
+    filename = FIG_FILENAME.format(n, data_class)
+
+    limit = CONFIG['PLOT_DENSITY_LIMIT']
+    if limit is not None and len(occurrences) > limit:
+        points = [(e3, e2) for e1, e2, e3, e4, e5 in occurrences]
+        marked = [(e3, e2) for e1, e2, e3, e4, e5 in occurrences if e5]
+        plt.plot_density(points, marked, colors[0], threshold, threshold_color, xlabel, ylabel, figname, filename)
+        return
+
     plot_marked = []
     plot_notmarked = []
-    threshold = occurrences[0][1] * CONFIG['TETA_COVERWORDS']
 
     for item in occurrences:
         if item[4]:
@@ -261,17 +347,70 @@ def plot(occurrences, data_class, n):
     notmarked_plotlist = [(e3, e2) for e1, e2, e3, e4, e5 in plot_notmarked]
 
     lists = [marked_plotlist, notmarked_plotlist]
-    colors = ["red", "blue"]
-    threshold_color = "green"
-    xlabel = "Number of occurences"
-    ylabel = "Covered publications"
-    figname = FIGURE_NAME.format(data_class.upper(), n)
-    filename = FIG_FILENAME.format(n, data_class)
     plt.plot_dots(lists, colors, threshold, threshold_color, xlabel, ylabel, figname, filename)
 
+def solve_set_cover(relationship_matrix, warm_start=None):
+    """Solves the Minimum Set Cover problem described by a relationship matrix
+
+    The documents that are not covered by any n-gram are ignored.
+
+    Parameters
+    ----------
+    relationship_matrix : numpy.ndarray
+        The matrix as returned by get_relationship_matrix
+    warm_start : numpy.ndarray, optional
+        A selection of columns, possibly shorter than the number of columns,
+        from which a greedy cover is completed. This cover is kept without
+        running the solver if it is provably minimum, or if it is smaller than
+        the solution found by the solver
+
+    Returns
+    -------
+    numpy.ndarray
+        boolean array telling which columns are in the set cover
+    """
+    ncols = relationship_matrix.shape[1]
+    solution = np.zeros(ncols, dtype=bool)
+
+    relationship_matrix = relationship_matrix[relationship_matrix.any(axis=1)]
+    if relationship_matrix.shape[0] == 0:
+        return solution
+
+    cost = np.ones(ncols)
+
+    g = setcover.SetCover(relationship_matrix, cost)
+    display.disable_print()
+    if warm_start is not None:
+        # Complete the previous cover with the greedy heuristic. The solver is
+        # skipped when this cover reaches a lower bound of the minimum cover:
+        # the columns covering a document alone, or the Lagrangian bound of
+        # the initial multipliers of the solver
+        g.s[:len(warm_start)] |= warm_start
+        g.greedy()
+        warm_cover = np.copy(g.s)
+        reduced_cost = cost - g.a_csc.dot(g.u)
+        lower_bound = max(np.count_nonzero(g.f_uniq), g.u.sum() + reduced_cost[reduced_cost < 0].sum())
+        if np.count_nonzero(warm_cover) <= np.ceil(lower_bound - 1e-9):
+            display.enable_print()
+            solution[:] = warm_cover
+            return solution
+
+    g.SolveSCP()
+    solution[:] = g.s
+    if warm_start is not None and np.count_nonzero(warm_cover) < np.count_nonzero(solution):
+        solution[:] = warm_cover
+    display.enable_print()
+
+    return solution
+
 def save_to_file(occurrences, n, data_class):
     """Saves the n-grams in a LaTeX table format
 
+    The rows are written while they are produced and can be capped with the
+    DUMP_MAX_ROWS and DUMP_MIN_SUPPORT fields of the config file (the support
+    being the ratio of covered publications). The table is compressed with
+    gzip if DUMP_COMPRESS is set.
+
     Parameters
     ----------
     occurrences : list
@@ -282,11 +421,13 @@ def save_to_file(occurrences, n, data_class):
     data_class : str
         The class to handle
     """
-    grams = []
-    for occ in occurrences:
-        grams.append([occ[0], occ[1], occ[2], occ[4]])
+    grams = ([occ[0], occ[1], occ[2], occ[4]] for occ in occurrences)
 
-    exh.write_latex_table(grams, ALL_NGRAMS_FILENAME.format(n, data_class))
+    filename = ALL_NGRAMS_FILENAME.format(n, data_class)
+    if CONFIG['DUMP_COMPRESS']:
+        filename += ".gz"
+
+    exh.stream_latex_table(grams, filename, CONFIG['DUMP_MAX_ROWS'], CONFIG['DUMP_MIN_SUPPORT'])
 
 def save_topwords(topwords):
     """Saves all the n-grams selected in set covers in a JSON file
@@ -326,7 +467,7 @@ def process_ngrams(n, data, data_class):
     list
         set cover with n-grams above the threshold
     """
-    print("Process for {0}".format(data_class))
+    print("Process for {0} ({1}-grams)".format(data_class, n))
 
     # Number of documents in data
     n_data = len(data)
@@ -362,10 +503,139 @@ def process_ngrams(n, data, data_class):
     scores = check_score(set_cover, subsets, normalized, data)
     exh.write_text(scores, SCORE_FILENAME.format(data_class, n))
 
-    display.display_ok("Process for {0} done".format(data_class))
+    display.display_ok("Process for {0} ({1}-grams) done".format(data_class, n))
 
     return subsets, set_cover
 
+def sweep_ngrams(n, data, data_class, tetas):
+    """Solves the set cover of a publications set for several values of the
+    threshold, counting the n-grams and building the relationship matrix once
+
+    As the n-grams are sorted by coverage, the n-grams above a threshold are
+    the first columns of the relationship matrix built for the lowest one. The
+    thresholds are handled from the highest to the lowest so that each cover,
+    completed with the greedy heuristic, is used as a warm start for the next
+    one: the solver only runs from scratch when this cover is not provably
+    minimum.
+
+    Parameters
+    ----------
+    n : int
+        The length of the n-grams
+    data : list
+        The publications list to handle
+    data_class : str
+        The class to handle
+    tetas : list
+        The values of TETA_COVERWORDS to evaluate
+
+    Returns
+    -------
+    list
+        one row (teta, threshold, number of n-grams above the threshold, size
+        of the set cover, ratio of publications covered by the set cover) for
+        each value of teta
+    """
+    print("Sweep for {0} ({1}-grams)".format(data_class, n))
+
+    occurrences = ngh.count_occurrences(n, data)
+    normalized = ngh.normalize_occurrences(occurrences, len(data))
+
+    tetas = sorted(tetas, reverse=True)
+    candidates = filter_words(normalized, normalized[0][1] * tetas[-1])
+
+    pmid_ids = index_pmids(data)
+    relationship_matrix = get_relationship_matrix(candidates, pmid_ids)
+
+    summary = []
+    solution = None
+    for teta in tetas:
+        threshold = normalized[0][1] * teta
+        subsets = filter_words(candidates, threshold)
+        solution = solve_set_cover(relationship_matrix[:, :len(subsets)], solution)
+
+        set_cover = [subsets[i] for i in np.flatnonzero(solution)]
+        scores = check_score(set_cover, subsets, normalized, data)
+        exh.write_text(scores, SWEEP_SCORE_FILENAME.format(data_class, n, teta))
+
+        n_covered = np.count_nonzero(relationship_matrix[:, :len(subsets)][:, solution].any(axis=1))
+        summary.append((teta, threshold, len(subsets), len(set_cover), n_covered / len(data)))
+
+    exh.write_csv(summary, ["Teta", "Threshold", "N-grams above threshold",
+        "Set cover size", "Ratio of publications covered"],
+        SWEEP_SUMMARY_FILENAME.format(data_class, n))
+
+    display.display_ok("Sweep for {0} ({1}-grams) done".format(data_class, n))
+
+    return summary
+
+def sweep_job(job):
+    """Runs the threshold sweep of a (n, class) pair using the publications
+    loaded by the main process
+
+    Parameters
+    ----------
+    job : tuple
+        The length of the n-grams, the class to handle and the values of teta
+
+    Returns
+    -------
+    list
+        the summary rows returned by sweep_ngrams
+    """
+    n, data_class, tetas = job
+    return sweep_ngrams(n, DOCUMENTS[data_class], data_class, tetas)
+
+def process_job(job):
+    """Searches the top n-grams and the set cover of a (n, class) pair using
+    the publications loaded by the main process
+
+    Parameters
+    ----------
+    job : tuple
+        The length of the n-grams and the class to handle
+
+    Returns
+    -------
+    list
+        n-grams above the threshold fixed in config file
+    list
+        set cover with n-grams above the threshold
+    """
+    n, data_class = job
+    return process_ngrams(n, DOCUMENTS[data_class], data_class)
+
+def process_all(function, jobs, processes):
+    """Processes all the (n, class) pairs, in parallel if more than one process
+    is allowed
+
+    The publications are shared with the worker processes through fork, so
+    they are loaded only once by the main process.
+
+    Parameters
+    ----------
+    function : function
+        The function handling a job
+    jobs : list
+        The (n, class) pairs to handle
+    processes : int
+        The maximum number of processes to use
+
+    Returns
+    -------
+    list
+        the results of function for each job, in the order of jobs
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+
+    if processes <= 1 or not "fork" in multiprocessing.get_all_start_methods():
+        return [function(job) for job in jobs]
+
+    with multiprocessing.get_context("fork").Pool(processes) as pool:
+        return pool.map(function, jobs, chunksize=1)
+
 def run(args):
     """Executes the main process of the script
 
@@ -386,26 +656,32 @@ def run(args):
     notdida_data = exh.load_json(FILENAME_TEMPLATE.format(CONFIG['NOTDIDA_DOCS']))
     display.display_ok("Loading publications done")
 
+    DOCUMENTS["dida"] = dida_data
+    DOCUMENTS["notdida"] = notdida_data
+
     n = CONFIG['NGRAMS']
 
+    if args.sweep is not None:
+        jobs = [(i, data_class, args.sweep) for i in range(1, n+1) for data_class in ["dida", "notdida"]]
+        print("Starting threshold sweep for 1-grams to {0}-grams".format(n))
+        process_all(sweep_job, jobs, args.processes)
+        display.display_info("All results were saved in {0} directory".format(DIRECTORY))
+        return
+
     subsets_dida = []
     subsets_notdida = []
 
     covers = []
-    for i in range(1, n+1):
-        print("Starting analysis for {0}-grams".format(i))
-
-        # Process on DIDA class
-        subset, set_cover = process_ngrams(i, dida_data, "dida")
-        subsets_dida.extend(subset)
-        covers.extend(set_cover)
-
-        # Process on Not-DIDA class
-        subset, set_cover = process_ngrams(i, notdida_data, "notdida")
-        subsets_notdida.extend(subset)
+    jobs = [(i, data_class) for i in range(1, n+1) for data_class in ["dida", "notdida"]]
+    print("Starting analysis for 1-grams to {0}-grams".format(n))
+    results = process_all(process_job, jobs, args.processes)
+    for (i, data_class), (subset, set_cover) in zip(jobs, results):
+        if data_class == "dida":
+            subsets_dida.extend(subset)
+        else:
+            subsets_notdida.extend(subset)
         covers.extend(set_cover)
-
-        display.display_ok("Analysis for {0}-grams done".format(i))
+    display.display_ok("Analysis for 1-grams to {0}-grams done".format(n))
 
     print("Searching set cover with all grams for DIDA")
     set_cover = get_set_cover(subsets_dida)
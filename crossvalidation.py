@@ -0,0 +1,554 @@
+"""Evaluates the classifiers with a k-fold cross-validation
+
+This script allows the user to evaluate the words distribution based
+classifiers and the words clustering based classifiers on publications which
+were not used to build the words distribution or the clusters.
+
+The publications are split in k stratified folds. For each fold, the words
+distribution and the clusters are built from the other folds only, then the
+classifiers are evaluated on the held-out fold. The n-grams and the words of
+each publication are counted once in shared sparse matrices, and the counts of
+each training split are obtained by subtracting the rows of the held-out fold
+from the counts of the whole data set. The folds are evaluated in parallel
+processes.
+
+The confusion matrices of all folds are summed for each threshold and each
+number of clusters, and the f1-score is computed on these sums. The mean and
+the standard deviation of the f1-scores of the folds are also saved.
+
+The number of folds and the seed used to split the publications are defined by
+the CV_FOLDS and CV_SEED fields of the config file.
+
+The script can be run through the following command :
+`python crossvalidation.py CONFIG`
+where `CONFIG` is the name of the configuration file situated in the `config`
+folder (without the extension).
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from copy import deepcopy
+from scipy import sparse
+
+import display
+import explorer_helper as exh
+import ibmethod as ib
+import plotter as plt
+import wordsdistribution_classification as wdc
+
+from classifiers.wordsdistribution import WordsDistribution, StrictClassifier, SplitWeightedClassifier, WeightedClassifier
+
+CONFIG = None
+
+DIRECTORY = "crossvalidation"
+FILENAME_TEMPLATE = "documents/{0}.json"
+LOG_FILENAME = DIRECTORY + "/{0}_{1}.json"
+FSCORE_FILENAME = DIRECTORY + "/{0}_fscore.png"
+
+CLASSIFIERS = [
+    ("strict", "Strict Classifier", StrictClassifier),
+    ("splitweighted", "Split Weighted Classifier", SplitWeightedClassifier),
+    ("weighted", "Weighted Classifier", WeightedClassifier)
+]
+CONVERTERS = [
+    ("strict", "Strict converter"),
+    ("doublon", "Doublon converter")
+]
+# Key of the unclustered vocabulary (one cluster per word) in the results
+ALL_WORDS = "all words"
+
+# Data shared by the processes evaluating the folds
+DATA = dict()
+
+
+
+""" CONFIGURATION """
+
+def check_args(argv):
+    """Checks and parses the arguments of the command typed by the user
+
+    Parameters
+    ----------
+    argv :
+        The arguments of the command typed by the user
+
+    Returns
+    -------
+    ArgumentParser
+        the values of the arguments of the commande typed by the user
+    """
+    parser = argparse.ArgumentParser(description="Evaluates the classifiers \
+        with a k-fold cross-validation")
+    parser.add_argument('CONFIG', type=str, help="the name of the configuration file (without extension)")
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count(),
+        help="the number of processes evaluating the folds")
+    parser.add_argument('--only', type=str, default=None,
+        choices=["wordsdistribution", "wordsclustering"],
+        help="evaluates only one family of classifiers")
+    args = parser.parse_args()
+
+    return args
+
+
+
+""" FUNCTIONS """
+
+def split_folds(y_true, n_folds, seed):
+    """Assigns each publication to a fold, keeping the ratio of both classes
+
+    Parameters
+    ----------
+    y_true : numpy.ndarray
+        The true class of each publication
+    n_folds : int
+        The number of folds
+    seed : int
+        The seed of the random generator
+
+    Returns
+    -------
+    numpy.ndarray
+        the fold of each publication
+    """
+    random = np.random.RandomState(seed)
+    folds = np.zeros(len(y_true), dtype=int)
+    for label in np.unique(y_true):
+        indices = random.permutation(np.flatnonzero(y_true == label))
+        folds[indices] = np.arange(len(indices)) % n_folds
+    return folds
+
+def ngrams_matrix(docs, n):
+    """Builds the sparse matrix telling which n-grams occur in each publication
+
+    Parameters
+    ----------
+    docs : list
+        The publications
+    n : int
+        The maximum length of the n-grams
+
+    Returns
+    -------
+    tuple
+        the CSR matrix (publications x n-grams) and the array of the n-grams,
+        written as in the CSV files of the words distribution
+    """
+    index = dict()
+    rows = []
+    cols = []
+    for i, doc in enumerate(docs):
+        found = set()
+        for length in range(1, n+1):
+            for gram in doc['grams'][str(length)]:
+                found.add(index.setdefault('(' + ', '.join(gram) + ')', len(index)))
+        rows.extend([i] * len(found))
+        cols.extend(found)
+
+    grams = np.empty(len(index), dtype=object)
+    for gram, col in index.items():
+        grams[col] = gram
+
+    data = np.ones(len(cols), dtype=np.int32)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(docs), len(index))), grams
+
+def words_matrix(docs):
+    """Builds the sparse matrix of the number of occurrences of each word in
+    each publication
+
+    Parameters
+    ----------
+    docs : list
+        The publications
+
+    Returns
+    -------
+    tuple
+        the CSR matrix (publications x words) and the sorted list of the words
+    """
+    words = sorted({word for doc in docs for word in doc['text'].split(' ')})
+    index = {word: i for i, word in enumerate(words)}
+
+    rows = []
+    cols = []
+    for i, doc in enumerate(docs):
+        doc_words = doc['text'].split(' ')
+        rows.extend([i] * len(doc_words))
+        cols.extend(index[word] for word in doc_words)
+
+    # Duplicate entries are summed
+    data = np.ones(len(cols), dtype=np.int32)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(docs), len(words))), words
+
+def training_counts(matrix, totals, rows):
+    """Counts of a training split, obtained by subtracting the held-out rows
+    from the counts of the whole data set
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        The shared count matrix
+    totals : numpy.ndarray
+        The column sums of the matrix for the publications of a class
+    rows : numpy.ndarray
+        The held-out publications of this class
+
+    Returns
+    -------
+    numpy.ndarray
+        the column sums for the training publications of this class
+    """
+    return totals - np.asarray(matrix[rows].sum(axis=0)).ravel()
+
+def confusion(y_true, y_pred):
+    """Performs the confusion matrices of many predictions
+
+    Parameters
+    ----------
+    y_true : numpy.ndarray
+        The true class of each publication
+    y_pred : numpy.ndarray
+        The predictions (publications x models)
+
+    Returns
+    -------
+    dict
+        the numbers of true and false positives and negatives of each model
+    """
+    y = np.asarray(y_true, dtype=bool)[:, np.newaxis]
+    y_pred = np.asarray(y_pred, dtype=bool)
+    return {
+        "tn": np.count_nonzero(~y_pred & ~y, axis=0),
+        "fp": np.count_nonzero(y_pred & ~y, axis=0),
+        "fn": np.count_nonzero(~y_pred & y, axis=0),
+        "tp": np.count_nonzero(y_pred & y, axis=0)
+    }
+
+def f1_scores(results):
+    """Performs the f1-scores of confusion matrices"""
+    tp = np.asarray(results['tp'])
+    denominator = 2 * tp + np.asarray(results['fp']) + np.asarray(results['fn'])
+    return np.where(denominator > 0, 2 * tp / np.maximum(denominator, 1), 0.)
+
+def distribution_fold(fold):
+    """Evaluates the words distribution based classifiers on a fold
+
+    Parameters
+    ----------
+    fold : int
+        The held-out fold
+
+    Returns
+    -------
+    dict
+        the thresholds and the confusion matrices of each classifier
+    """
+    matrix = DATA['ngrams']
+    y_true = DATA['y_true']
+    test = DATA['folds'] == fold
+
+    # Ratio of training publications of each class containing each n-gram
+    ratios = []
+    for label in [1, 0]:
+        rows = np.flatnonzero(test & (y_true == label))
+        n_train = np.count_nonzero(~test & (y_true == label))
+        ratios.append(training_counts(matrix, DATA['ngrams_totals'][label], rows) / n_train)
+
+    # N-grams occurring in the training publications
+    cols = np.flatnonzero((ratios[0] > 0) | (ratios[1] > 0))
+    distribution = WordsDistribution.from_weights(DATA['grams'][cols], ratios[0][cols], ratios[1][cols])
+    presence = matrix[np.flatnonzero(test)][:, cols[distribution.order]]
+
+    results = dict()
+    for model, _, Classifier in CLASSIFIERS:
+        results[model] = wdc.evaluate(Classifier, presence, distribution, y_true[test])
+    return results
+
+def cluster_counts(n_words):
+    """Gives the numbers of clusters evaluated, as in the words clustering
+    classification script, for a vocabulary size
+
+    The last count is the vocabulary size itself (one cluster per word), the
+    Naive Bayes classifier on the unclustered words."""
+    counts = [n for n in range(1, 11) if n < n_words]
+    counts.extend(range(100, n_words, 100))
+    counts.append(n_words)
+    return counts
+
+def naive_bayes_predictions(Nc_cluster, Pc, converted):
+    """Predicts the class of publications converted into clusters
+
+    The probabilities are multiplied in log-space, so that long publications do
+    not make them vanish.
+
+    Parameters
+    ----------
+    Nc_cluster : numpy.ndarray
+        The number of occurrences of the words of each cluster in each category
+        (categories x clusters)
+    Pc : numpy.ndarray
+        The probability of each category
+    converted : scipy.sparse.csr_matrix
+        The number of times each cluster is counted in each publication
+
+    Returns
+    -------
+    numpy.ndarray
+        the predicted category of each publication
+    """
+    Nc_cluster = Nc_cluster + 0.5
+    Pcluster_c = Nc_cluster / Nc_cluster.sum(axis=1)[:, np.newaxis]
+    log_probas = converted.dot(np.log(Pcluster_c).T) + np.log(Pc)
+    return np.argmax(log_probas, axis=1)
+
+def clustering_fold(fold):
+    """Evaluates the words clustering based classifiers on a fold
+
+    Parameters
+    ----------
+    fold : int
+        The held-out fold
+
+    Returns
+    -------
+    dict
+        the numbers of clusters and the confusion matrices of each converter
+    """
+    matrix = DATA['words']
+    y_true = DATA['y_true']
+    test = DATA['folds'] == fold
+
+    # Occurrences of each word in the training publications of each category,
+    # the categories being ordered as in the words clustering script
+    Ncw = []
+    n_docs = []
+    for label in [0, 1]:
+        rows = np.flatnonzero(test & (y_true == label))
+        Ncw.append(training_counts(matrix, DATA['words_totals'][label], rows))
+        n_docs.append(np.count_nonzero(~test & (y_true == label)))
+    Ncw = np.array(Ncw, dtype=float)
+
+    # Words occurring in the training publications
+    cols = np.flatnonzero(Ncw.sum(axis=0) > 0)
+    Ncw = Ncw[:, cols]
+    words = [DATA['W'][c] for c in cols]
+
+    Pcw = Ncw + 0.5
+    Pcw = Pcw / Pcw.sum()
+    n_words = Ncw.sum()
+    Pw = {word: Ncw[:, w].sum() / n_words for w, word in enumerate(words)}
+    dtype = np.float32 if CONFIG['IB_FLOAT32'] else np.float64
+    clusterer = ib.IBClusterer(dtype, CONFIG['IB_MEMMAP_DIRECTORY'], CONFIG['IB_NEIGHBOURS'],
+        threads=DATA['ib_threads'], verbose=DATA['ib_verbose'])
+    linkage = clusterer.fit(Pcw, Pw).linkage
+
+    Pc = np.array(n_docs) / sum(n_docs)
+    occurrences = matrix[np.flatnonzero(test)][:, cols]
+    presence = (occurrences > 0).astype(np.int32)
+
+    results = {converter: {"n_clusters": [], "tn": [], "fp": [], "fn": [], "tp": []} for converter, _ in CONVERTERS}
+    for n_clusters in cluster_counts(len(words)):
+        # Membership of each word (words x clusters)
+        word_clusters = np.zeros(len(words), dtype=np.int64)
+        for id_cluster, cluster in enumerate(ib.cut(linkage, n_clusters)):
+            word_clusters[cluster] = id_cluster
+        membership = sparse.csr_matrix((np.ones(len(words)), (np.arange(len(words)), word_clusters)),
+            shape=(len(words), n_clusters))
+        Nc_cluster = membership.T.dot(Ncw.T).T
+
+        converted = {
+            "strict": (presence.dot(membership) > 0).astype(float),
+            "doublon": occurrences.dot(membership)
+        }
+        for converter, _ in CONVERTERS:
+            y_pred = naive_bayes_predictions(Nc_cluster, Pc, converted[converter]) == 1
+            matrices = confusion(y_true[test], y_pred[:, np.newaxis])
+            # The vocabulary size differs between the folds
+            results[converter]['n_clusters'].append(ALL_WORDS if n_clusters == len(words) else n_clusters)
+            for key in matrices:
+                results[converter][key].append(int(matrices[key][0]))
+    return results
+
+def fold_job(job):
+    """Evaluates a family of classifiers on a fold"""
+    family, fold = job
+    display.display_info("Evaluating {0} on fold {1}".format(family, fold+1))
+    if family == "wordsdistribution":
+        results = distribution_fold(fold)
+    else:
+        results = clustering_fold(fold)
+    display.display_ok("Evaluating {0} on fold {1} done".format(family, fold+1))
+    return family, fold, results
+
+def process_all(jobs, processes):
+    """Evaluates the folds, in parallel processes if possible
+
+    The processes are forked so that they share the count matrices, and share
+    the CPUs for the agglomerative information of the IB method.
+
+    Parameters
+    ----------
+    jobs : list
+        The families of classifiers and the folds to evaluate
+    processes : int
+        The number of processes
+
+    Returns
+    -------
+    list
+        the results of each job
+    """
+    if processes is None or not 'fork' in multiprocessing.get_all_start_methods():
+        processes = 1
+    processes = max(1, min(processes, len(jobs)))
+    # Threads of the IB method in each process, its progress being only
+    # displayed when the folds are evaluated one after the other
+    DATA['ib_threads'] = max(1, (os.cpu_count() or 1) // processes)
+    DATA['ib_verbose'] = processes == 1
+    if processes == 1:
+        return [fold_job(job) for job in jobs]
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        return pool.map(fold_job, jobs, chunksize=1)
+
+def aggregate(fold_results, key):
+    """Sums the confusion matrices of the folds and performs the f1-scores
+
+    Only the values of the key (thresholds or numbers of clusters) evaluated in
+    every fold are kept.
+
+    Parameters
+    ----------
+    fold_results : list
+        The results of a classifier for each fold
+    key : str
+        The key of the evaluated values
+
+    Returns
+    -------
+    dict
+        the summed confusion matrices, the f1-score of these sums and the mean
+        and standard deviation of the f1-scores of the folds
+    """
+    values = [v for v in fold_results[0][key] if all(v in r[key] for r in fold_results)]
+    results = {key: values, "tn": [], "fp": [], "fn": [], "tp": []}
+    fold_scores = []
+    for r in fold_results:
+        positions = [r[key].index(v) for v in values]
+        selected = {m: np.asarray(r[m])[positions] for m in ["tn", "fp", "fn", "tp"]}
+        fold_scores.append(f1_scores(selected))
+        for m in selected:
+            results[m] = selected[m] if len(results[m]) == 0 else results[m] + selected[m]
+
+    results['score'] = f1_scores(results)
+    results['score_mean'] = np.mean(fold_scores, axis=0)
+    results['score_std'] = np.std(fold_scores, axis=0)
+    return results
+
+def save_results(results, family, model, key):
+    """Saves the cross-validated confusion matrices and f1-scores in JSON file
+
+    Parameters
+    ----------
+    results : dict
+        The aggregated results of a classifier
+    family : str
+        The family of the classifier
+    model : str
+        The prefix string of the classifier
+    key : str
+        The key of the evaluated values
+    """
+    data = dict()
+    for index, v in enumerate(results[key]):
+        data[v] = dict()
+        for m in ["tn", "tp", "fn", "fp"]:
+            data[v][m] = int(results[m][index])
+        for m in ["score", "score_mean", "score_std"]:
+            data[v][m] = float(results[m][index])
+
+    exh.write_json(data, LOG_FILENAME.format(family, model))
+
+
+
+""" EXECUTION """
+
+def run(args):
+    """Executes the main process of the script
+
+    Parameters
+    ----------
+    args : ArgumentParser
+        The arguments of the command typed by the user
+    """
+    global CONFIG
+    CONFIG = exh.load_json("config/{0}.json".format(args.CONFIG))
+    wdc.CONFIG = CONFIG
+
+    exh.create_directory(DIRECTORY)
+
+    print("Loading publications")
+    # Load DIDA publications
+    dida_data = exh.load_json(FILENAME_TEMPLATE.format(CONFIG['DIDA_DOCS']))
+    # Load Not-DIDA publications
+    notdida_data = exh.load_json(FILENAME_TEMPLATE.format(CONFIG['NOTDIDA_DOCS']))
+    display.display_ok("Loading publications done")
+
+    docs = deepcopy(dida_data)
+    docs.extend(deepcopy(notdida_data))
+
+    # Real labels of each publication
+    y_true = np.append(np.ones(len(dida_data)), np.zeros(len(notdida_data))).astype(int)
+    n_folds = CONFIG['CV_FOLDS']
+    DATA['y_true'] = y_true
+    DATA['folds'] = split_folds(y_true, n_folds, CONFIG['CV_SEED'])
+
+    families = ["wordsdistribution", "wordsclustering"] if args.only is None else [args.only]
+
+    if "wordsdistribution" in families:
+        print("Counting n-grams")
+        DATA['ngrams'], DATA['grams'] = ngrams_matrix(docs, CONFIG['NGRAMS'])
+        DATA['ngrams_totals'] = {label: np.asarray(DATA['ngrams'][y_true == label].sum(axis=0)).ravel() for label in [0, 1]}
+        display.display_ok("Counting n-grams done")
+
+    if "wordsclustering" in families:
+        print("Counting words")
+        DATA['words'], DATA['W'] = words_matrix(docs)
+        DATA['words_totals'] = {label: np.asarray(DATA['words'][y_true == label].sum(axis=0)).ravel() for label in [0, 1]}
+        display.display_ok("Counting words done")
+
+    print("Evaluating {0} folds".format(n_folds))
+    jobs = [(family, fold) for family in families for fold in range(n_folds)]
+    results = process_all(jobs, args.processes)
+    display.display_ok("Evaluating {0} folds done".format(n_folds))
+
+    if "wordsdistribution" in families:
+        fold_results = [r for family, _, r in results if family == "wordsdistribution"]
+        scores = []
+        for model, _, _ in CLASSIFIERS:
+            aggregated = aggregate([r[model] for r in fold_results], "threshold")
+            save_results(aggregated, "wordsdistribution", model, "threshold")
+            scores.append(aggregated['score'])
+        plt.plot_lines(aggregated['threshold'], scores, [name for _, name, _ in CLASSIFIERS],
+            FSCORE_FILENAME.format("wordsdistribution"), "Threshold", "F1-score")
+        display.display_info("Results saved in " + DIRECTORY)
+
+    if "wordsclustering" in families:
+        fold_results = [r for family, _, r in results if family == "wordsclustering"]
+        scores = []
+        for converter, _ in CONVERTERS:
+            aggregated = aggregate([r[converter] for r in fold_results], "n_clusters")
+            save_results(aggregated, "wordsclustering", converter, "n_clusters")
+            scores.append(aggregated['score'])
+        positions = [i for i, n in enumerate(aggregated['n_clusters']) if n != ALL_WORDS]
+        plt.plot_lines([aggregated['n_clusters'][i] for i in positions], [s[positions] for s in scores],
+            [name for _, name in CONVERTERS],
+            FSCORE_FILENAME.format("wordsclustering"), "Number of clusters", "F1-score", step=1000)
+        display.display_info("Results saved in " + DIRECTORY)
+
+if __name__ == "__main__":
+    args = check_args(sys.argv)
+    run(args)
@@ -6,20 +6,43 @@ directories.
 This file can be imported as a module and contains the following functions:
 
     * create_directory - creates a directory if it does not exist
+    * limit_rows - caps the number of rows and their support
     * load_json - loads a JSON file
+    * load_sparse - loads a sparse matrix saved by write_sparse
+    * open_text - opens a text file, compressed with gzip if its name ends
+    with .gz
+    * stream_csv - saves rows into a CSV file while they are produced
+    * stream_latex_table - saves rows into a text file in a LaTex table format
+    while they are produced
     * write_csv - saves data into a CSV file
     * write_json - saves data into a JSON file
     * write_latex_table - saves data into a text file in a LaTex table format
+    * write_sparse - saves a sparse matrix into a directory of NumPy files
     * write_text - saves data into a text file
 """
 
 import csv
+import gzip
+import itertools
 import json
+import numbers
 import os
 import tabulate
 
+import numpy as np
+
+from scipy import sparse
+
 tabulate.LATEX_ESCAPE_RULES={}
 
+# Escaping of the special characters of LaTeX in the cells written by
+# stream_latex_table, the rules of tabulate being disabled above
+LATEX_ESCAPE_RULES = {
+    '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#', '_': r'\_', '^': r'\^{}',
+    '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '\\': r'\textbackslash{}',
+    '<': r'\ensuremath{<}', '>': r'\ensuremath{>}'
+}
+
 def create_directory(dir_name):
     """Creates a directory if it does not exist
 
@@ -31,6 +54,32 @@ def create_directory(dir_name):
     if not os.path.exists(dir_name) or not os.path.isdir(dir_name):
             os.mkdir(dir_name)
 
+def limit_rows(rows, max_rows=None, min_support=None, support_index=1):
+    """Caps the number of rows and their support
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows to cap
+    max_rows : int, optional
+        The maximum number of rows to keep (all the rows are kept if None)
+    min_support : float, optional
+        The minimum absolute value of the support column for a row to be kept
+        (all the rows are kept if None)
+    support_index : int, optional
+        The index of the support column
+
+    Returns
+    -------
+    iterator
+        the rows satisfying the caps
+    """
+    if min_support is not None:
+        rows = (row for row in rows if abs(row[support_index]) >= min_support)
+    if max_rows is not None:
+        rows = itertools.islice(rows, max_rows)
+    return iter(rows)
+
 def load_json(filename):
     """Loads a JSON file
 
@@ -47,6 +96,46 @@ def load_json(filename):
     with open(filename, 'r') as f:
         return json.load(f)
 
+def load_sparse(dir_name, mmap_mode='r'):
+    """Loads a sparse matrix saved by write_sparse
+
+    Parameters
+    ----------
+    dir_name : str
+        The name of the directory containing the matrix
+    mmap_mode : str, optional
+        The mode in which the arrays of the matrix are memory-mapped (None to
+        read them in memory)
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        the loaded matrix
+    """
+    arrays = [np.load(dir_name + "/{0}.npy".format(name), mmap_mode=mmap_mode)
+        for name in ["data", "indices", "indptr"]]
+    shape = tuple(np.load(dir_name + "/shape.npy"))
+    return sparse.csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+def open_text(filename, mode='w'):
+    """Opens a text file, compressed with gzip if its name ends with .gz
+
+    Parameters
+    ----------
+    filename : str
+        The name of the file to open
+    mode : str, optional
+        The mode in which the file is opened ('r' or 'w')
+
+    Returns
+    -------
+    file
+        the opened text file
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', newline='')
+    return open(filename, mode, newline='')
+
 def save_to_log(results, model, key, filename):
     """Saves the evolution of the confusion matrix and the f1-score in JSON file
 
@@ -68,6 +157,79 @@ def save_to_log(results, model, key, filename):
 
     write_json(data, filename)
 
+def stream_csv(rows, cols, filename, max_rows=None, min_support=None, support_index=1):
+    """Saves rows into a CSV file while they are produced
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows to save in a CSV file
+    cols: list
+        The name of the columns
+    filename : str
+        The name of the CSV file in which the data must be saved, compressed
+        with gzip if it ends with .gz
+    max_rows : int, optional
+        The maximum number of rows to save
+    min_support : float, optional
+        The minimum absolute value of the support column for a row to be saved
+    support_index : int, optional
+        The index of the support column
+
+    Returns
+    -------
+    int
+        the number of saved rows
+    """
+    n_rows = 0
+    with open_text(filename) as out:
+        csv_out = csv.writer(out)
+        csv_out.writerow(cols)
+        for row in limit_rows(rows, max_rows, min_support, support_index):
+            csv_out.writerow(row)
+            n_rows += 1
+    return n_rows
+
+def stream_latex_table(rows, filename, max_rows=None, min_support=None, support_index=1):
+    """Saves rows into a text file in a LaTex table format while they are
+    produced
+
+    The alignment of the columns is deduced from the first row.
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows to save in a text file
+    filename : str
+        The name of the text file in which the data must be saved, compressed
+        with gzip if it ends with .gz
+    max_rows : int, optional
+        The maximum number of rows to save
+    min_support : float, optional
+        The minimum absolute value of the support column for a row to be saved
+    support_index : int, optional
+        The index of the support column
+
+    Returns
+    -------
+    int
+        the number of saved rows
+    """
+    rows = limit_rows(rows, max_rows, min_support, support_index)
+    first = next(rows, None)
+
+    n_rows = 0
+    with open_text(filename) as fp:
+        # An empty tabular when no row is saved
+        aligns = ''.join(['r' if _is_number(v) else 'l' for v in first]) if first is not None else ''
+        fp.write("\\begin{tabular}{" + aligns + "}\n\\hline\n")
+        if first is not None:
+            for row in itertools.chain([first], rows):
+                fp.write(' ' + ' & '.join([_latex_cell(v) for v in row]) + ' \\\\\n')
+                n_rows += 1
+        fp.write("\\hline\n\\end{tabular}")
+    return n_rows
+
 def write_csv(data, cols, filename):
     """Saves data into a CSV file
 
@@ -111,6 +273,26 @@ def write_latex_table(data, filename):
     latex_tab = tabulate.tabulate(data,tablefmt='latex')
     write_text(latex_tab, filename)
 
+def write_sparse(matrix, dir_name):
+    """Saves a sparse matrix into a directory of NumPy files
+
+    The arrays of the CSR format are saved in separate files, so that they can
+    be memory-mapped when the matrix is loaded.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.spmatrix
+        The matrix to save
+    dir_name : str
+        The name of the directory in which the matrix is saved
+    """
+    create_directory(dir_name)
+    matrix = sparse.csr_matrix(matrix)
+    np.save(dir_name + "/data.npy", matrix.data)
+    np.save(dir_name + "/indices.npy", matrix.indices)
+    np.save(dir_name + "/indptr.npy", matrix.indptr)
+    np.save(dir_name + "/shape.npy", np.array(matrix.shape))
+
 def write_text(data, filename):
     """Saves data into a text file
 
@@ -123,3 +305,14 @@ def write_text(data, filename):
     """
     with open(filename, 'w') as fp:
         fp.write(data)
+
+def _is_number(value):
+    """Tells if a value is a number, booleans excluded"""
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+def _latex_cell(value):
+    """Formats a value as a cell of a LaTex table, the special characters
+    being escaped with the default rules of tabulate"""
+    if isinstance(value, float):
+        return format(value, 'g')
+    return ''.join([LATEX_ESCAPE_RULES.get(c, c) for c in str(value)])
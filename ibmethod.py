@@ -1,128 +1,684 @@
-import math
+import multiprocessing
+import os
+import tempfile
+import time
+import zipfile
 
 import numpy as np
 
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 
 import display
 
-global clusters, Pcluster, Pc_cluster, agg_info, Pcw, Pw, backup
+BLOCK_SIZE = 2**22 # Number of pair costs computed at once by all the threads
+ROUNDING = 1e-12 # Margin of the lower bounds for the rounding errors of the costs
 
-def initialize_clusters():
-    global clusters, Pcluster, Pc_cluster
-    clusters = []
-    Pcluster = []
-    n_words = len(Pw)
-    n_categories = len(Pcw)
-    Pc_cluster = np.zeros((n_categories, n_words))
+# agg_info only stores the upper triangle (i < j) of the matrix of costs, row
+# after row as in scipy.spatial.distance.squareform: the costs of the pairs
+# (i, j > i) are contiguous and start at offsets[i]
 
-    for i in range(n_words):
-        clusters.append([i])
-        Pcluster.append(Pw[i])
+def row_offsets(n):
+    i = np.arange(n+1, dtype=np.int64)
+    return n*i - i*(i+1)//2
 
-        for j in range(n_categories):
-            Pc_cluster[j,i] = Pcw[j,i] / Pcluster[i]
-
-def js_divergence(cluster_i, cluster_j, n_categories):
-    p_cluster_star = Pcluster[cluster_i] + Pcluster[cluster_j]
-    pi_i = Pcluster[cluster_i] / p_cluster_star
-    pi_j = Pcluster[cluster_j] / p_cluster_star
+def merge_costs(p_i, pc_i, p_j, pc_j):
+    # Agglomerative information of merging clusters i and j, of probabilities
+    # p and distributions pc over the categories (first axis), broadcast
+    # together: the Jensen-Shannon divergence of their distributions,
+    # weighted by their probabilities, times the probability of their merge
+    p_cluster_star = p_i + p_j
+    pi_i = p_i / p_cluster_star
+    pi_j = p_j / p_cluster_star
 
     dkl_i = 0
     dkl_j = 0
-    for c in range(n_categories):
-        p = pi_i * Pc_cluster[c, cluster_i] + pi_j * Pc_cluster[c, cluster_j]
-        dkl_i += (Pc_cluster[c, cluster_i] * math.log10(Pc_cluster[c, cluster_i] / p))
-        dkl_j += (Pc_cluster[c, cluster_j] * math.log10(Pc_cluster[c, cluster_j] / p))
+    for c in range(len(pc_i)):
+        p = pi_i * pc_i[c] + pi_j * pc_j[c]
+        dkl_i = dkl_i + pc_i[c] * np.log10(pc_i[c] / p)
+        dkl_j = dkl_j + pc_j[c] * np.log10(pc_j[c] / p)
 
     js_d = pi_i * dkl_i + pi_j * dkl_j
 
-    return js_d
-
-def agglomerative_information():
-    global agg_info
-
-    n_words = len(Pw)
-    n_categories = len(Pcw)
-    agg_info = np.zeros((n_words, n_words)) + np.Inf
-    for i in range(n_words):
-        s = "Agglomerative information for word {0} on {1}".format(i+1, n_words)
-        print (s, end="\r")
-        # print("Agglomerative information for word {0} / {1}".format(i+1, n_words))
-        for j in range(i+1, n_words):
-            js_d = js_divergence(i,j, n_categories)
-            agg_info[i,j] = (Pcluster[i] + Pcluster[j]) * js_d
-    print(s)
-
-def initialization():
-    print("Starting clusters initialization")
-    initialize_clusters()
-    display.display_ok("Clusters initialization done")
-    print("Processing agglomerative information")
-    agglomerative_information()
-    display.display_ok("Processing agglomerative information done")
-
-def backup_clusters(n_clusters):
-    cleaned_clusters = [deepcopy(c) for c in clusters if len(c) != 0]
-    backup[n_clusters] = cleaned_clusters
-
-def loop(M):
-    backup_clusters(M)
-    n_categories = len(Pcw)
-    print("Starting IB method loop")
-    for m in range(M-1, 0, -1):
-        s = "Running iteration {0} on {1}".format(M-m, M-1)
-        print (s, end="\r")
-        # print("Iteration {0} / {1}".format(M-m, M-1))
-        # Find minimum cost
-        cluster_i, cluster_j = np.argwhere(agg_info == agg_info.min())[0]
-
-        # Merge clusters
+    return (p_i + p_j) * js_d
+
+class IBClusterer:
+    # Agglomerative IB method, each instance owning the state of its
+    # clustering so that several ones can run in the same process.
+    # The agglomerative information can be stored with a smaller dtype (e.g.
+    # np.float32) and in a temporary file of memmap_dir instead of in memory.
+    # With two categories, neighbours (k) gives the same merges without
+    # storing it, from the k neighbours of each cluster in the order of the
+    # last category. The state of the loop is saved in the file checkpoint
+    # every checkpoint_merges merges or checkpoint_minutes minutes, and the
+    # loop continues from this file if resume is set and it exists. threads
+    # compute the agglomerative information (all the CPUs by default).
+
+    def __init__(self, dtype=np.float64, memmap_dir=None, neighbours=None, checkpoint=None,
+            checkpoint_merges=None, checkpoint_minutes=None, resume=False, threads=None,
+            verbose=True):
+        self.dtype = dtype
+        self.memmap_dir = memmap_dir
+        self.neighbours = neighbours
+        self.checkpoint = checkpoint
+        self.checkpoint_merges = checkpoint_merges
+        self.checkpoint_minutes = checkpoint_minutes
+        self.resume = resume
+        self.threads = threads or os.cpu_count() or 1
+        self.verbose = verbose
+
+        self.clusters = None
+        self.Pcluster = None
+        self.Pc_cluster = None
+        self.agg_info = None
+        self.offsets = None
+        self.Pcw = None
+        self.Pw = None
+        self.linkage = None
+        self.order = None
+        self.order_keys = None
+        self.bounds = None
+        self.n_evaluated = 0
+
+    def log(self, s, end="\n"):
+        if self.verbose:
+            print(s, end=end)
+
+    def log_ok(self, s):
+        if self.verbose:
+            display.display_ok(s)
+
+    def log_info(self, s):
+        if self.verbose:
+            display.display_info(s)
+
+    def condensed_index(self, i, j):
+        # Position of the pair (i, j), i < j, in agg_info
+        return self.offsets[i] + (np.asarray(j, dtype=np.int64) - i - 1)
+
+    def condensed_pair(self, k):
+        # Pair (i, j) stored at the position k of agg_info
+        i = int(np.searchsorted(self.offsets, k, side='right')) - 1
+        return i, int(k - self.offsets[i]) + i + 1
+
+    def row_costs(self, i):
+        # Costs of the pairs (i, j > i)
+        return self.agg_info[self.offsets[i]:self.offsets[i+1]]
+
+    def column_indices(self, j):
+        # Positions of the pairs (i < j, j)
+        return self.condensed_index(np.arange(j, dtype=np.int64), j)
+
+    def initialize_clusters(self):
+        # Id (as in a SciPy linkage) and size of the cluster of each slot
+        self.clusters = {"ids": np.arange(len(self.Pw)), "sizes": np.ones(len(self.Pw), dtype=np.int64)}
+        Pcluster = []
+        n_words = len(self.Pw)
+        n_categories = len(self.Pcw)
+        self.Pc_cluster = np.zeros((n_categories, n_words))
+
+        for i in range(n_words):
+            Pcluster.append(self.Pw[i])
+
+            for j in range(n_categories):
+                self.Pc_cluster[j,i] = self.Pcw[j,i] / Pcluster[i]
+
+        self.Pcluster = np.array(Pcluster)
+
+    def pair_costs(self, rows, cols):
+        # Agglomerative information of each pair (rows, cols) of clusters, rows
+        # and cols being broadcast together
+        return merge_costs(self.Pcluster[rows], self.Pc_cluster[:, rows],
+            self.Pcluster[cols], self.Pc_cluster[:, cols])
+
+    def allocate_agg_info(self, n_words):
+        self.offsets = row_offsets(n_words)
+        n_pairs = int(self.offsets[-1])
+        if self.memmap_dir is None:
+            self.agg_info = np.full(n_pairs, np.inf, dtype=self.dtype)
+            storage = "memory"
+        else:
+            # Temporary file on disk, deleted when the clustering is finished
+            f = tempfile.NamedTemporaryFile(dir=self.memmap_dir, suffix=".agg_info")
+            self.agg_info = np.memmap(f, dtype=self.dtype, mode='w+', shape=(max(n_pairs, 1),))[:n_pairs]
+            self.agg_info.file = f
+            storage = f.name
+
+        self.log_info("Agglomerative information of {0} pairs : {1:.1f} MB of {2} ({3})".format(
+            n_pairs, n_pairs * np.dtype(self.dtype).itemsize / 2**20, np.dtype(self.dtype).name, storage))
+
+    def agglomerative_information(self):
+        n_words = len(self.Pw)
+        self.allocate_agg_info(n_words)
+
+        # Blocks of rows computed by parallel threads (NumPy releases the GIL),
+        # each one with the columns of the upper triangle. The threads share
+        # BLOCK_SIZE, so that the temporaries of merge_costs in flight (about
+        # 8 arrays of a block) do not grow with the number of threads
+        block_size = max(1, BLOCK_SIZE // (max(n_words, 1) * self.threads))
+        blocks = [(start, min(start + block_size, n_words)) for start in range(0, n_words, block_size)]
+
+        def fill_block(block):
+            start, end = block
+            costs = self.pair_costs(np.arange(start, end)[:, np.newaxis], np.arange(start, n_words)[np.newaxis, :])
+            for i in range(start, end):
+                self.row_costs(i)[:] = costs[i - start, i - start + 1:]
+            return end
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            for end in executor.map(fill_block, blocks):
+                s = "Agglomerative information for word {0} on {1}".format(end, n_words)
+                self.log(s, end="\r")
+        self.log(s)
+
+    def initialization(self):
+        self.log("Starting clusters initialization")
+        self.initialize_clusters()
+        self.log_ok("Clusters initialization done")
+        if self.neighbours is None:
+            self.log("Processing agglomerative information")
+            self.agglomerative_information()
+            self.log_ok("Processing agglomerative information done")
+
+    def nearest_neighbour(self, i):
+        # Cheapest pair (i, j > i), the first one in case of tie
+        row = self.row_costs(i)
+        if len(row) == 0:
+            return i, np.inf
+        k = int(np.argmin(row))
+        return i + 1 + k, row[k]
+
+    def merge(self, cluster_i, cluster_j, cost, t, M):
+        # Merges cluster j into the slot of cluster i as the merge t of the
+        # linkage
+        Pcluster = self.Pcluster
+        Pc_cluster = self.Pc_cluster
+        clusters = self.clusters
         p_w = Pcluster[cluster_i] + Pcluster[cluster_j]
         pi_i = Pcluster[cluster_i] / p_w
         pi_j = Pcluster[cluster_j] / p_w
-        pc_w = []
-        for c in range(n_categories):
-            temp = pi_i * Pc_cluster[c, cluster_i] + pi_j * Pc_cluster[c, cluster_j]
-            pc_w.append(temp)
+        pc_w = pi_i * Pc_cluster[:, cluster_i] + pi_j * Pc_cluster[:, cluster_j]
 
-        clusters[cluster_i].extend(clusters[cluster_j])
+        self.linkage[t] = [clusters['ids'][cluster_i], clusters['ids'][cluster_j],
+            cost, clusters['sizes'][cluster_i] + clusters['sizes'][cluster_j]]
+        clusters['ids'][cluster_i] = M + t
+        clusters['sizes'][cluster_i] += clusters['sizes'][cluster_j]
         Pcluster[cluster_i] = p_w
-        for c in range(n_categories):
-            Pc_cluster[c, cluster_i] = pc_w[c]
-
-        # Remove cluster j
-        clusters[cluster_j].clear()
-
-        for j in range(cluster_j+1, M):
-            agg_info[cluster_j][j] = np.Inf
-        for i in range(cluster_j):
-            agg_info[i][cluster_j] = np.Inf
-
-        # Update cost
-        for j in range(cluster_i+1, M):
-            if agg_info[cluster_i,j] != np.Inf:
-                # update agg_info[cluster_i][j]
-                js_d = js_divergence(cluster_i,j, n_categories)
-                agg_info[cluster_i,j] = (Pcluster[cluster_i] + Pcluster[j]) * js_d
-        for i in range(cluster_i):
-            if agg_info[i][cluster_i] != np.Inf:
-                # update agg_info[i][cluster_i]
-                js_d = js_divergence(i, cluster_i, n_categories)
-                agg_info[i, cluster_i] = (Pcluster[i] + Pcluster[cluster_i]) * js_d
-
-        backup_clusters(m)
-    print(s)
-    display.display_ok("IB method loop done")
-
-def cluster(p_cw, p_w):
-    global Pcw, Pw, backup
-    Pcw = p_cw
-    Pw = p_w
-    words = [w for w in Pw.items()]
+        Pc_cluster[:, cluster_i] = pc_w
+
+    def loop(self, M, checkpoint=None, state=None):
+        # Each cluster i caches the cheapest pair (i, j > i) of its row: the
+        # cheapest pair of all is the one of the first cluster having the
+        # lowest cached cost, which is the first minimum of agg_info in
+        # row-major order
+        agg_info = self.agg_info
+        self.log("Starting IB method loop")
+        if state is None:
+            # Merge tree in the SciPy format: the ids of the merged clusters
+            # (the cluster kept in its slot first), the cost of the merge and
+            # the size of the new cluster, whose id is M plus the index of the
+            # merge
+            self.linkage = np.zeros((M-1, 4))
+            active = np.ones(M, dtype=bool)
+            nn = np.zeros(M, dtype=np.int64)
+            nn_cost = np.empty(M, dtype=agg_info.dtype)
+            for i in range(M):
+                nn[i], nn_cost[i] = self.nearest_neighbour(i)
+            start = 0
+        else:
+            active, nn, nn_cost = state['active'], state['nn'], state['nn_cost']
+            start = int(state['merges'])
+
+        for m in range(M-1-start, 0, -1):
+            s = "Running iteration {0} on {1}".format(M-m, M-1)
+            self.log(s, end="\r")
+            # Find minimum cost
+            cluster_i = int(np.argmin(nn_cost))
+            cluster_j = int(nn[cluster_i])
+
+            # Merge clusters
+            self.merge(cluster_i, cluster_j, nn_cost[cluster_i], M-m-1, M)
+
+            # Remove cluster j
+            active[cluster_j] = False
+
+            self.row_costs(cluster_j)[:] = np.inf
+            agg_info[self.column_indices(cluster_j)] = np.inf
+            nn_cost[cluster_j] = np.inf
+
+            # Update cost of the pairs of cluster i
+            others = np.flatnonzero(active[cluster_i+1:]) + cluster_i + 1
+            if len(others) > 0:
+                self.row_costs(cluster_i)[others - cluster_i - 1] = self.pair_costs(cluster_i, others)
+            column = self.column_indices(cluster_i)
+            others = np.flatnonzero(active[:cluster_i])
+            if len(others) > 0:
+                agg_info[column[others]] = self.pair_costs(others, cluster_i)
+
+            # Update nearest neighbours: the clusters pointing to i or j search
+            # their row again, the other clusters before i may now point to i
+            nn[cluster_i], nn_cost[cluster_i] = self.nearest_neighbour(cluster_i)
+            before = np.flatnonzero(active[:cluster_j])
+            stale = before[(nn[before] == cluster_i) | (nn[before] == cluster_j)]
+            stale = stale[stale != cluster_i]
+            for k in stale:
+                nn[k], nn_cost[k] = self.nearest_neighbour(k)
+
+            others = others[(nn[others] != cluster_i) & (nn[others] != cluster_j)]
+            costs = agg_info[column[others]]
+            closer = (costs < nn_cost[others]) | ((costs == nn_cost[others]) & (cluster_i < nn[others]))
+            nn[others[closer]] = cluster_i
+            nn_cost[others[closer]] = costs[closer]
+
+            if m > 1 and self.checkpoint_due(checkpoint, M-m-1):
+                self.save_checkpoint(checkpoint, M-m-1, {"neighbours": 0, "active": active,
+                    "nn": nn, "nn_cost": nn_cost, "agg_info": agg_info})
+        self.log(s)
+        self.log_ok("IB method loop done")
+
+    # With two categories, the distribution of a cluster over the categories
+    # is almost given by its probability in the last one, p(dida|cluster)
+    # with the CLUSTERING_CLASSES of the config file: the cheap pairs are the
+    # clusters close in the order of this probability. Since
+    # x log(x/m) - x + m >= (x-m)^2 / (2 max(x, m)),
+    # the cost of a pair (i, j) is at least
+    # (a_i-a_j)^2 P_i P_j / (P_i+P_j) / (2 ln(10) max(a_i, a_j)),
+    # a being the probabilities in the last category, so that only the pairs
+    # whose bound does not exceed the cost of a close pair have to be
+    # evaluated. order lists the active clusters sorted by this probability
+    # (order_keys).
+
+    def cost_lower_bounds(self, i, others):
+        # Lower bounds of the costs of the pairs (i, others), minus a margin
+        # for the rounding errors of pair_costs
+        a_i = self.Pc_cluster[-1][i]
+        a_j = self.Pc_cluster[-1][others]
+        p_i = self.Pcluster[i]
+        p_j = self.Pcluster[others]
+        bound = (a_i - a_j)**2 * (p_i * p_j / (p_i + p_j)) / (2 * np.log(10) * np.maximum(a_i, a_j))
+        return bound - ROUNDING * (p_i + p_j) * self.bounds['sum']
+
+    def ordered_rank(self, i):
+        # Position of cluster i in order
+        key = self.Pc_cluster[-1][i]
+        start = int(np.searchsorted(self.order_keys, key, side='left'))
+        end = int(np.searchsorted(self.order_keys, key, side='right'))
+        return start + int(np.flatnonzero(self.order[start:end] == i)[0])
+
+    def bounded_nearest_neighbour(self, i, k):
+        # Cheapest pair (i, j > i), the first one in case of tie, as
+        # nearest_neighbour but without agg_info: the pairs of i with its k
+        # neighbours in order (or more if they are all before i) give an upper
+        # bound of the cheapest cost, then the pairs whose lower bound does not
+        # exceed it are evaluated
+        order = self.order
+        bounds = self.bounds
+        r = self.ordered_rank(i)
+        width = k
+        while True:
+            window = order[max(0, r - width):r + width + 1]
+            window = window[window > i]
+            if len(window) > 0 or width >= len(order):
+                break
+            width *= 2
+        if len(window) == 0:
+            return i, np.inf
+        upper = self.pair_costs(i, window).min() * (1 + ROUNDING)
+
+        # Clusters close enough in order, the probability of the other cluster
+        # being at least the smallest probability of a word
+        p_i = self.Pcluster[i]
+        scale = p_i * bounds['p_min'] / (p_i + bounds['p_min']) / (2 * np.log(10) * bounds['a_max'])
+        delta = np.sqrt((upper + ROUNDING * bounds['sum']) / scale)
+        key = self.Pc_cluster[-1][i]
+        start = int(np.searchsorted(self.order_keys, key - delta, side='left'))
+        end = int(np.searchsorted(self.order_keys, key + delta, side='right'))
+        candidates = np.sort(order[start:end])
+        candidates = candidates[candidates > i]
+        candidates = candidates[self.cost_lower_bounds(i, candidates) <= upper]
+
+        costs = self.pair_costs(i, candidates)
+        self.n_evaluated += len(window) + len(candidates)
+        j = int(np.argmin(costs))
+        return int(candidates[j]), costs[j]
+
+    def bounded_loop(self, M, k, checkpoint=None, state=None):
+        # Same merges as loop, the caches being filled by
+        # bounded_nearest_neighbour
+        Pc_cluster = self.Pc_cluster
+        self.log("Starting IB method loop")
+        if state is None:
+            self.linkage = np.zeros((M-1, 4))
+            self.order = np.argsort(Pc_cluster[-1], kind='mergesort')
+            self.order_keys = Pc_cluster[-1][self.order]
+            # The merged distributions are weighted means of the distributions
+            # of the words and the merged probabilities are larger: the bounds
+            # stay valid
+            self.bounds = {
+                "p_min": self.Pcluster.min(),
+                "a_max": Pc_cluster[-1].max(),
+                "sum": Pc_cluster.sum(axis=0).max()
+            }
+            self.n_evaluated = 0
+
+            active = np.ones(M, dtype=bool)
+            nn = np.zeros(M, dtype=np.int64)
+            nn_cost = np.empty(M)
+            for i in range(M):
+                nn[i], nn_cost[i] = self.bounded_nearest_neighbour(i, k)
+                if (i+1) % 1000 == 0 or i+1 == M:
+                    s = "Nearest neighbour of word {0} on {1}".format(i+1, M)
+                    self.log(s, end="\r")
+            self.log(s)
+            start = 0
+        else:
+            active, nn, nn_cost = state['active'], state['nn'], state['nn_cost']
+            start = int(state['merges'])
+
+        for m in range(M-1-start, 0, -1):
+            s = "Running iteration {0} on {1}".format(M-m, M-1)
+            self.log(s, end="\r")
+            # Find minimum cost
+            cluster_i = int(np.argmin(nn_cost))
+            cluster_j = int(nn[cluster_i])
+
+            # Merge clusters, cluster i moving in order
+            ranks = [self.ordered_rank(cluster_i), self.ordered_rank(cluster_j)]
+            self.order = np.delete(self.order, ranks)
+            self.order_keys = np.delete(self.order_keys, ranks)
+            self.merge(cluster_i, cluster_j, nn_cost[cluster_i], M-m-1, M)
+            key = Pc_cluster[-1][cluster_i]
+            r = int(np.searchsorted(self.order_keys, key))
+            self.order = np.insert(self.order, r, cluster_i)
+            self.order_keys = np.insert(self.order_keys, r, key)
+
+            # Remove cluster j
+            active[cluster_j] = False
+            nn_cost[cluster_j] = np.inf
+
+            # Update nearest neighbours as in loop, the pairs of cluster i with
+            # the clusters before it being evaluated when their bound does not
+            # exceed the cached cost
+            nn[cluster_i], nn_cost[cluster_i] = self.bounded_nearest_neighbour(cluster_i, k)
+            before = np.flatnonzero(active[:cluster_j])
+            stale = before[(nn[before] == cluster_i) | (nn[before] == cluster_j)]
+            stale = stale[stale != cluster_i]
+            for i in stale:
+                nn[i], nn_cost[i] = self.bounded_nearest_neighbour(i, k)
+
+            others = np.flatnonzero(active[:cluster_i])
+            others = others[(nn[others] != cluster_i) & (nn[others] != cluster_j)]
+            others = others[self.cost_lower_bounds(cluster_i, others) <= nn_cost[others] * (1 + ROUNDING)]
+            costs = self.pair_costs(others, cluster_i)
+            self.n_evaluated += len(others)
+            closer = (costs < nn_cost[others]) | ((costs == nn_cost[others]) & (cluster_i < nn[others]))
+            nn[others[closer]] = cluster_i
+            nn_cost[others[closer]] = costs[closer]
+
+            if m > 1 and self.checkpoint_due(checkpoint, M-m-1):
+                bounds = self.bounds
+                self.save_checkpoint(checkpoint, M-m-1, {"neighbours": k, "active": active,
+                    "nn": nn, "nn_cost": nn_cost, "order": self.order, "order_keys": self.order_keys,
+                    "p_min": bounds['p_min'], "a_max": bounds['a_max'], "sum": bounds['sum'],
+                    "n_evaluated": self.n_evaluated})
+        self.log(s)
+        self.log_info("Costs evaluated : {0} for {1} pairs of words".format(self.n_evaluated, M*(M-1)//2))
+        self.log_ok("IB method loop done")
+
+    # A checkpoint is a NumPy archive of the state of the loop after a merge:
+    # the slots of the clusters, their probabilities and distributions, the
+    # merge tree, the nearest neighbours caches and the costs (agg_info or the
+    # order of the bounded loop), with the distributions of the words to check
+    # that it is resumed with the same ones. It is written every
+    # checkpoint['merges'] merges or checkpoint['minutes'] minutes.
+
+    def checkpoint_due(self, checkpoint, t):
+        # Whether a checkpoint has to be written after the merge t
+        if checkpoint is None:
+            return False
+        if checkpoint['merges'] is not None and (t+1) % checkpoint['merges'] == 0:
+            return True
+        return checkpoint['minutes'] is not None and time.time() - checkpoint['time'] >= 60 * checkpoint['minutes']
+
+    def save_checkpoint(self, checkpoint, t, state):
+        # Written in a temporary file renamed when complete, so that a process
+        # stopped while writing leaves the previous checkpoint
+        filename = checkpoint['filename']
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, merges=t+1, Pcw=self.Pcw, Pw=self.Pw, ids=self.clusters['ids'],
+                sizes=self.clusters['sizes'], Pcluster=self.Pcluster, Pc_cluster=self.Pc_cluster,
+                linkage=self.linkage, **state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+        checkpoint['time'] = time.time()
+        self.log_info("Checkpoint of merge {0} saved into {1}".format(t+1, filename))
+
+    def load_agg_info(self, filename):
+        # Copies the costs of a checkpoint into agg_info by blocks, as it may
+        # be memory-mapped
+        agg_info = self.agg_info
+        with zipfile.ZipFile(filename) as archive, archive.open("agg_info.npy") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            if shape != agg_info.shape or dtype != agg_info.dtype:
+                raise ValueError("The costs of the checkpoint {0} are {1} of shape {2}".format(filename, dtype, shape))
+            for start in range(0, len(agg_info), BLOCK_SIZE):
+                block = agg_info[start:start + BLOCK_SIZE]
+                block[:] = np.frombuffer(f.read(block.nbytes), dtype=dtype)
+
+    def load_checkpoint(self, filename):
+        # Restores the state of the loop and returns its variables
+        with np.load(filename) as data:
+            if (int(data['neighbours']) != (self.neighbours or 0) or not np.array_equal(data['Pcw'], self.Pcw)
+                    or not np.array_equal(data['Pw'], self.Pw)):
+                raise ValueError("The checkpoint {0} does not come from the same clustering".format(filename))
+            self.clusters = {"ids": data['ids'], "sizes": data['sizes']}
+            self.Pcluster = data['Pcluster']
+            self.Pc_cluster = data['Pc_cluster']
+            self.linkage = data['linkage']
+            state = {key: data[key] for key in ["merges", "active", "nn", "nn_cost"]}
+            if self.neighbours is None:
+                self.allocate_agg_info(len(self.Pw))
+                self.load_agg_info(filename)
+            else:
+                self.order = data['order']
+                self.order_keys = data['order_keys']
+                self.bounds = {key: data[key][()] for key in ["p_min", "a_max", "sum"]}
+                self.n_evaluated = int(data['n_evaluated'])
+        self.log_info("Resuming after merge {0} from {1}".format(int(state['merges']), filename))
+        return state
+
+    def fit(self, Pcw, Pw):
+        # Pcw is the joint distribution of the categories (rows) and the words
+        # (columns), in the order of the words of the dict Pw
+        self.Pcw = Pcw
+        words = [w for w in Pw.items()]
+        words.sort()
+        self.Pw = [v for k,v in words]
+        neighbours = self.neighbours
+        if neighbours is not None and (len(self.Pcw) != 2 or neighbours < 1):
+            raise ValueError("The bounded IB method needs two categories and at least one neighbour")
+
+        state = None
+        if self.resume and self.checkpoint is not None and os.path.exists(self.checkpoint):
+            state = self.load_checkpoint(self.checkpoint)
+        else:
+            self.initialization()
+
+        schedule = None
+        if self.checkpoint is not None:
+            schedule = {"filename": self.checkpoint, "merges": self.checkpoint_merges,
+                "minutes": self.checkpoint_minutes, "time": time.time()}
+        if neighbours is None:
+            self.loop(len(self.Pw), schedule, state)
+            self.agg_info = None
+        else:
+            self.bounded_loop(len(self.Pw), neighbours, schedule, state)
+        return self
+
+    def cut(self, n_clusters):
+        return cut(self.linkage, n_clusters)
+
+def cut(linkage, n_clusters):
+    # Partition in n_clusters clusters, before the last n_clusters-1 merges:
+    # the clusters are ordered by their smallest word and their words in the
+    # order of the merges, as the clusters of the loop
+    n_words = len(linkage) + 1
+    n_merges = n_words - n_clusters
+    children = linkage[:n_merges, :2].astype(np.int64)
+
+    # Smallest word of each cluster, the one of the cluster kept in its slot
+    first_word = np.arange(n_words + n_merges)
+    for t in range(n_merges):
+        first_word[n_words + t] = first_word[children[t, 0]]
+
+    roots = np.ones(n_words + n_merges, dtype=bool)
+    roots[children.ravel()] = False
+    roots = np.flatnonzero(roots)
+    roots = roots[np.argsort(first_word[roots], kind='mergesort')]
+
+    partition = []
+    for root in roots:
+        words = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node < n_words:
+                words.append(int(node))
+            else:
+                stack.append(children[node - n_words, 1])
+                stack.append(children[node - n_words, 0])
+        partition.append(words)
+    return partition
+
+def partition(labels):
+    # Clusters of the words labelled by the sequential IB method, ordered as
+    # the clusters given by cut
+    labels = np.asarray(labels)
+    words = np.argsort(labels, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(labels[words])) + 1
+    partition = [group.tolist() for group in np.split(words, bounds)]
+    partition.sort(key=lambda words: words[0])
+    return partition
+
+def cluster(p_cw, p_w, dtype=np.float64, memmap_dir=None, neighbours=None,
+        checkpoint=None, checkpoint_merges=None, checkpoint_minutes=None, resume=False):
+    # Linkage of a single clustering, see IBClusterer
+    clusterer = IBClusterer(dtype, memmap_dir, neighbours, checkpoint, checkpoint_merges,
+        checkpoint_minutes, resume)
+    return clusterer.fit(p_cw, p_w).linkage
+
+def fit_job(job):
+    p_cw, p_w, options = job
+    return IBClusterer(**options).fit(p_cw, p_w).linkage
+
+def fit_all(jobs, processes=None):
+    # Linkages of several clusterings, given as (p_cw, p_w, options of
+    # IBClusterer), computed by a pool of processes which share the CPUs for
+    # the agglomerative information. Their progress is only displayed when
+    # they are computed one after the other
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(jobs)))
+    defaults = {"threads": max(1, (os.cpu_count() or 1) // processes), "verbose": processes == 1}
+    jobs = [(p_cw, p_w, dict(defaults, **options)) for p_cw, p_w, options in jobs]
+    if processes == 1:
+        return [fit_job(job) for job in jobs]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(fit_job, jobs, chunksize=1)
+
+# Sequential IB method: from a random partition in n_clusters clusters, each
+# word is in turn drawn out of its cluster and put back in the cluster of
+# cheapest merge (its own cluster in case of tie), until no word moves or
+# after max_iterations passes. The
+# costs are the ones of the agglomerative method, so that each move
+# increases sum_t sum_c p(c,t) log(p(c|t)/p(c)), the information kept on
+# the categories, which chooses the best of several random restarts.
+
+def sequential_job(job):
+    p_cw, p_w, n_clusters, seed, max_iterations = job
+    p_w = np.asarray(p_w)
+    n_words = len(p_w)
+    n_categories = len(p_cw)
+    pc_w = p_cw / p_w
+    random = np.random.RandomState(seed)
+
+    # Random partition without empty cluster
+    labels = random.permutation(np.arange(n_words) % n_clusters)
+    for iteration in range(max_iterations):
+        # Probability of each cluster, and its joint probability with each
+        # category, computed again at each pass against rounding errors
+        p_t = np.bincount(labels, weights=p_w, minlength=n_clusters)
+        pc_t = np.array([np.bincount(labels, weights=p_cw[c], minlength=n_clusters) for c in range(n_categories)])
+        sizes = np.bincount(labels, minlength=n_clusters)
+        n_moves = 0
+        for w in random.permutation(n_words):
+            t = labels[w]
+            if sizes[t] == 1:
+                continue
+            p_t[t] -= p_w[w]
+            pc_t[:, t] -= p_cw[:, w]
+            sizes[t] -= 1
+
+            # Only moved for a gain larger than the rounding errors, which
+            # would move the words between identical clusters forever
+            costs = merge_costs(p_w[w], pc_w[:, w], p_t, pc_t / p_t)
+            best = int(np.argmin(costs))
+            if costs[t] - costs[best] <= ROUNDING * (p_w[w] + p_t[t]):
+                best = t
+            else:
+                n_moves += 1
+
+            labels[w] = best
+            p_t[best] += p_w[w]
+            pc_t[:, best] += p_cw[:, w]
+            sizes[best] += 1
+        if n_moves == 0:
+            break
+
+    p_t = np.bincount(labels, weights=p_w, minlength=n_clusters)
+    pc_t = np.array([np.bincount(labels, weights=p_cw[c], minlength=n_clusters) for c in range(n_categories)])
+    p_c = p_cw.sum(axis=1)[:, np.newaxis]
+    information = float(np.sum(pc_t * np.log10(pc_t / p_t / p_c)))
+    return labels, information, iteration + 1
+
+def sequential_cluster(p_cw, p_w, n_clusters, restarts=1, seed=0, max_iterations=50, processes=None,
+        verbose=True):
+    # Labels (numbers of clusters x words, the words being sorted as in
+    # IBClusterer) of the best restart for each number of clusters, the
+    # restarts being run by a pool of processes. The information of each
+    # restart is displayed if verbose is set
+    words = [w for w in p_w.items()]
     words.sort()
-    Pw = [v for k,v in words]
-    initialization()
-    backup = dict()
-    loop(len(Pw))
-    return backup
+    p_w = [v for k,v in words]
+    for k in n_clusters:
+        if k < 1 or k > len(p_w):
+            raise ValueError("The sequential IB method cannot make {0} clusters of {1} words".format(k, len(p_w)))
+
+    jobs = [(p_cw, p_w, k, [seed, k, restart], max_iterations) for k in n_clusters for restart in range(restarts)]
+    labels = np.zeros((len(n_clusters), len(p_w)), dtype=np.int64)
+    best = np.full(len(n_clusters), -np.inf)
+
+    def keep_best(results):
+        for index, (result, information, iterations) in enumerate(results):
+            i = index // restarts
+            if verbose:
+                display.display_info("{0} clusters, restart {1} / {2} : information {3:.6g} after {4} passes".format(
+                    n_clusters[i], index % restarts + 1, restarts, information, iterations))
+            if information > best[i]:
+                labels[i] = result
+                best[i] = information
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(jobs)))
+    if processes == 1:
+        keep_best(map(sequential_job, jobs))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            keep_best(pool.imap(sequential_job, jobs))
+    return labels
@@ -1,6 +1,12 @@
+import multiprocessing
+
 import matplotlib.pyplot as plt
 import numpy as np
 
+from matplotlib.backends.backend_pdf import PdfPages
+
+BAR_FIGURE = None # Figure reused by each process of a PlotPool
+
 def autolabel(rects, ax):
     for rect in rects:
         h = rect.get_height()
@@ -26,6 +32,85 @@ def plot(filename, title, score_c1, score_c2, n_c1, n_c2, label_c1, label_c2, y_
     plt.close(fig)
     plt.clf()
 
+class BarFigure:
+    # Figure of the plot function created once and updated for each plot
+    def __init__(self, label_c1, label_c2, y_label):
+        ind = [0, 0.5]
+        self.fig = plt.figure()
+        self.ax = self.fig.add_subplot(111)
+        self.rects = self.ax.bar(ind, [0, 0], 0.25, color='b')
+        self.title = self.ax.set_title("")
+        self.ax.set_ylabel(y_label)
+        self.ax.set_xticks(ind)
+        self.ax.set_xticklabels((label_c1, label_c2))
+        self.labels = [self.ax.text(rect.get_x()+rect.get_width()/2., 0, "",
+            ha="center", va="bottom") for rect in self.rects]
+
+    def draw(self, title, score_c1, score_c2):
+        for rect, label, h in zip(self.rects, self.labels, [score_c1, score_c2]):
+            rect.set_height(h)
+            label.set_y(1.05*h)
+            label.set_text('%.3f'%h)
+        self.title.set_text(title)
+        self.ax.relim()
+        self.ax.autoscale_view()
+
+    def save(self, filename):
+        self.fig.savefig(filename)
+
+def _init_plot_worker(label_c1, label_c2, y_label):
+    global BAR_FIGURE
+    plt.switch_backend('Agg')
+    BAR_FIGURE = BarFigure(label_c1, label_c2, y_label)
+
+def _plot_bar(job):
+    filename, title, score_c1, score_c2 = job
+    BAR_FIGURE.draw(title, score_c1, score_c2)
+    BAR_FIGURE.save(filename)
+
+def _plot_bar_pages(filename, jobs):
+    with PdfPages(filename) as pdf:
+        for title, score_c1, score_c2 in jobs:
+            BAR_FIGURE.draw(title, score_c1, score_c2)
+            pdf.savefig(BAR_FIGURE.fig)
+
+class PlotPool:
+    # Background processes drawing the plots of the plot function with the Agg
+    # backend, so that the caller does not wait for them
+    def __init__(self, label_c1, label_c2, y_label, processes=None):
+        self.pool = multiprocessing.Pool(processes, initializer=_init_plot_worker,
+            initargs=(label_c1, label_c2, y_label))
+        self.results = []
+
+    def plot(self, jobs, chunksize=16):
+        # Each job is a tuple (filename, title, score_c1, score_c2)
+        self.results.append(self.pool.map_async(_plot_bar, jobs, chunksize))
+
+    def plot_pages(self, filename, jobs):
+        # Draws the jobs (title, score_c1, score_c2) as the pages of a single
+        # PDF file
+        self.results.append(self.pool.apply_async(_plot_bar_pages, (filename, list(jobs))))
+
+    def wait(self):
+        # Waits for the queued plots, raising the error of a failed one
+        for result in self.results:
+            result.get()
+        self.results = []
+
+    def close(self):
+        self.wait()
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.pool.terminate()
+
 def plot_confusion_matrix(results, n_c1, n_c2, prefix, key, s_key, directory, step=2):
     lines = [results['tp'], results['fp'], results['tn'], results['fn']]
     labels = ["True Positive", "False Positive", "True Negative", "False Negative"]
@@ -55,6 +140,27 @@ def plot_dots(lists, colors, threshold, threshold_color, xlabel, ylabel, figname
 
     plt.clf()
 
+def plot_density(points, marked, marked_color, threshold, threshold_color, xlabel, ylabel, figname, filename, gridsize=100):
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    marked = np.asarray(marked, dtype=float).reshape(-1, 2)
+
+    fig, ax = plt.subplots()
+
+    if len(points) > 0:
+        hb = ax.hexbin(points[:, 0], points[:, 1], gridsize=gridsize, bins='log', mincnt=1, cmap='Blues')
+        fig.colorbar(hb, ax=ax, label="Number of n-grams (log)")
+    if len(marked) > 0:
+        ax.scatter(marked[:, 0], marked[:, 1], s=10, c=marked_color)
+
+    ax.axhline(y=threshold, color=threshold_color, linestyle='-')
+
+    ax.set_title(figname)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+
+    plt.savefig(filename)
+    plt.close(fig)
+
 def plot_lines(threshold_l, lines, labels, filename, label_x, label_y, has_legend=True, step=2):
     fig, ax = plt.subplots()
 
@@ -0,0 +1,464 @@
+"""Scores new PubMed publications with the trained classifiers
+
+This script allows the user to triage new publications without running the
+whole analysis. It loads once the compact words distribution model exported by
+the `wordsdistribution_classification.py` script and the words clustering
+Naive Bayes classifier, then scores raw PubTator documents (as downloaded by
+`pubmed_helper.download_publications`). Documents are grouped in micro-batches
+before being scored.
+
+The models to use are defined by the SERVICE_WORDS_DISTRIBUTION_MODEL and
+SERVICE_N_CLUSTERS fields of the config file.
+
+The script can be run through the following commands :
+`python serve.py CONFIG`
+reads one JSON document per line on the standard input and writes one JSON
+result per line on the standard output ;
+`python serve.py CONFIG --http PORT`
+serves the documents POSTed (one document or a list of documents) on
+`http://127.0.0.1:PORT/score`, the statistics being available at `/stats` ;
+`python serve.py CONFIG --replay FILE`
+starts the HTTP service on a free local port and replays the documents of the
+JSON file `FILE` with local clients, then prints the latency and throughput.
+`CONFIG` is the name of the configuration file situated in the `config` folder
+(without the extension).
+"""
+
+import argparse
+import collections
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import urllib.request as req
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+
+import display
+import explorer_helper as exh
+import ibmethod as ib
+import pubmed_helper as pbmdh
+
+from classifiers.wordsclustering import NaiveBayesCluster
+from classifiers.wordsdistribution_model import load_model
+
+CONFIG = None
+
+WORDS_DISTRIBUTION_MODEL_DIRECTORY = "wordsdistribution/models/{0}"
+WORDS_CLUSTERING_DIRECTORY = "wordsclustering/{0}"
+
+
+
+""" CONFIGURATION """
+
+def check_args(argv):
+    """Checks and parses the arguments of the command typed by the user
+
+    Parameters
+    ----------
+    argv :
+        The arguments of the command typed by the user
+
+    Returns
+    -------
+    ArgumentParser
+        the values of the arguments of the commande typed by the user
+    """
+    parser = argparse.ArgumentParser(description="Scores new publications \
+        with the trained classifiers")
+    parser.add_argument('CONFIG', type=str, help="the name of the configuration file (without extension)")
+    parser.add_argument('--http', type=int, default=None, metavar='PORT',
+        help="serves the documents on a local HTTP port instead of the standard input")
+    parser.add_argument('--replay', type=str, default=None, metavar='FILE',
+        help="replays the documents of a JSON file with local clients")
+    parser.add_argument('--clients', type=int, default=4, help="the number \
+        of local clients used by --replay")
+    parser.add_argument('--batch-size', type=int, default=64, help="the \
+        maximum number of documents scored together")
+    parser.add_argument('--batch-wait', type=float, default=10, help="the \
+        maximum time (in milliseconds) waited to fill a batch")
+    args = parser.parse_args()
+
+    return args
+
+
+
+""" FUNCTIONS """
+
+def load_clusters(directory, n_clusters):
+    """Loads the clusters of the words clustering model
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the words clustering results
+    n_clusters : int
+        The number of clusters
+
+    Returns
+    -------
+    list
+        the words of each cluster
+    """
+    if os.path.exists(directory + "/linkage.npy"):
+        return ib.cut(np.load(directory + "/linkage.npy"), n_clusters)
+    # Partitions of the sequential IB method
+    numbers = np.load(directory + "/n_clusters.npy").tolist()
+    if not n_clusters in numbers:
+        raise ValueError("No partition in {0} clusters in {1}".format(n_clusters, directory))
+    return ib.partition(np.load(directory + "/labels.npy")[numbers.index(n_clusters)])
+
+class Statistics:
+    """Latency and throughput of the scored documents"""
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.n_documents = 0
+        self.n_batches = 0
+        self.first = None
+        self.last = None
+
+    def add_batch(self, latencies):
+        """Records the latencies (in seconds) of the documents of a batch"""
+        now = time.time()
+        with self.lock:
+            if self.first is None:
+                self.first = now - max(latencies)
+            self.last = now
+            self.n_documents += len(latencies)
+            self.n_batches += 1
+            self.latencies.extend(latencies)
+
+    def summary(self):
+        """Gives the number of documents, the throughput and the latencies"""
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            elapsed = (self.last - self.first) if self.first is not None else 0
+            return {
+                "documents": self.n_documents,
+                "batches": self.n_batches,
+                "throughput": self.n_documents / elapsed if elapsed > 0 else 0.,
+                "latency_ms_mean": float(latencies.mean()) if len(latencies) else 0.,
+                "latency_ms_p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.,
+                "latency_ms_p95": float(np.percentile(latencies, 95)) if len(latencies) else 0.
+            }
+
+class ScoringService:
+    """Scores raw PubTator documents by micro-batches in a background thread
+
+    Parameters
+    ----------
+    batch_size : int
+        The maximum number of documents scored together
+    batch_wait : float
+        The maximum time (in seconds) waited to fill a batch
+    """
+
+    def __init__(self, batch_size, batch_wait):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.statistics = Statistics()
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+
+        self._load_models()
+
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def _load_models(self):
+        """Loads the words distribution and words clustering models once"""
+        print("Loading models", file=sys.stderr)
+        self.words_distribution = load_model(WORDS_DISTRIBUTION_MODEL_DIRECTORY.format(CONFIG['SERVICE_WORDS_DISTRIBUTION_MODEL']))
+
+        directory = WORDS_CLUSTERING_DIRECTORY.format(CONFIG['ALL_CLUSTERS_DIRECTORY'])
+        words = np.load(directory + "/W.npy", mmap_mode='r').tolist()
+        ndw = exh.load_sparse(directory + "/ndw")
+        categories = np.load(directory + "/categories.npy", mmap_mode='r')
+        clusters = load_clusters(directory, CONFIG['SERVICE_N_CLUSTERS'])
+        self.words_clustering = NaiveBayesCluster(clusters, ndw, categories)
+
+        # Cluster of each known word
+        self.word_clusters = dict()
+        for id_cluster, cluster in enumerate(clusters):
+            for w in cluster:
+                self.word_clusters[words[w]] = id_cluster
+        print("Loading models done", file=sys.stderr)
+
+    def submit(self, document):
+        """Queues a raw PubTator document
+
+        Parameters
+        ----------
+        document : dict
+            The document to score
+
+        Returns
+        -------
+        Future
+            the future result of the document
+        """
+        future = Future()
+        with self.condition:
+            self.queue.append((time.time(), document, future))
+            self.condition.notify()
+        return future
+
+    def _next_batch(self):
+        """Waits for a document then gathers the batch"""
+        with self.condition:
+            while not self.queue:
+                self.condition.wait()
+            deadline = time.time() + self.batch_wait
+            while len(self.queue) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            n = min(len(self.queue), self.batch_size)
+            return [self.queue.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.score([document for _, document, _ in batch])
+            except Exception:
+                # Scores the documents one by one, so that only the invalid
+                # ones fail
+                results = []
+                for _, document, _ in batch:
+                    try:
+                        results.append(self.score([document])[0])
+                    except Exception as e:
+                        results.append(e)
+
+            now = time.time()
+            latencies = []
+            for (received, _, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                    continue
+                latencies.append(now - received)
+                result['latency_ms'] = latencies[-1] * 1000
+                future.set_result(result)
+            if latencies:
+                self.statistics.add_batch(latencies)
+
+    def score(self, documents):
+        """Scores a batch of raw PubTator documents
+
+        Parameters
+        ----------
+        documents : list
+            The documents to score
+
+        Returns
+        -------
+        list
+            the scores and predictions of each document
+        """
+        docs = pbmdh.extract_features(documents)
+        texts = [doc['text'] for doc in docs]
+
+        c1_scores, c2_scores = self.words_distribution.scores(texts)
+
+        converted = []
+        for text in texts:
+            clusters = []
+            for word in text.split(' '):
+                cluster = self.word_clusters.get(word)
+                if cluster is not None and not cluster in clusters:
+                    clusters.append(cluster)
+            converted.append({'converted': clusters})
+        clustering_scores = self.words_clustering.log_probas(converted)
+
+        results = []
+        for doc, c1, c2, log_probas in zip(docs, c1_scores, c2_scores, clustering_scores):
+            results.append({
+                "pmid": doc['pmid'],
+                "wordsdistribution": {
+                    "dida": float(c1),
+                    "notdida": float(c2),
+                    "prediction": int(c1 >= c2)
+                },
+                "wordsclustering": {
+                    "scores": {name: float(p) for name, p in zip(self.words_clustering.names, log_probas)},
+                    "prediction": int(np.argmax(log_probas))
+                }
+            })
+        return results
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def make_handler(service):
+    """Creates the HTTP request handler of a scoring service
+
+    Parameters
+    ----------
+    service : ScoringService
+        The service scoring the documents
+
+    Returns
+    -------
+    class
+        the request handler
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/stats":
+                self.send_error(404)
+                return
+            self._send(service.statistics.summary())
+
+        def do_POST(self):
+            if self.path != "/score":
+                self.send_error(404)
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                documents = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                self.send_error(400, "Invalid JSON")
+                return
+            single = isinstance(documents, dict)
+            if single:
+                documents = [documents]
+
+            futures = [service.submit(document) for document in documents]
+            try:
+                results = [future.result() for future in futures]
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            self._send(results[0] if single else results)
+
+        def _send(self, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve_stdin(service):
+    """Scores the JSON documents read line by line on the standard input
+
+    Parameters
+    ----------
+    service : ScoringService
+        The service scoring the documents
+    """
+    futures = collections.deque()
+
+    def write_ready(block):
+        while futures and (block or futures[0].done()):
+            try:
+                result = futures.popleft().result()
+            except Exception as e:
+                result = {"error": str(e)}
+            sys.stdout.write(json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+    for line in sys.stdin:
+        line = line.strip()
+        if line:
+            try:
+                document = json.loads(line)
+            except ValueError as e:
+                # Resolved future, so that the results stay in the input order
+                future = Future()
+                future.set_exception(e)
+                futures.append(future)
+            else:
+                futures.append(service.submit(document))
+        write_ready(False)
+    write_ready(True)
+
+def replay(service, filename, n_clients):
+    """Replays the documents of a file against the HTTP service with local
+    clients
+
+    Parameters
+    ----------
+    service : ScoringService
+        The service scoring the documents
+    filename : str
+        The name of the JSON file containing the documents
+    n_clients : int
+        The number of concurrent clients
+
+    Returns
+    -------
+    dict
+        the statistics of the service
+    """
+    documents = exh.load_json(filename)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{0}".format(server.server_address[1])
+
+    def post(document):
+        request = req.Request(url + "/score", data=json.dumps(document).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        return json.loads(req.urlopen(request).read().decode('utf-8'))
+
+    start = time.time()
+    with ThreadPoolExecutor(n_clients) as clients:
+        results = list(clients.map(post, documents))
+    elapsed = time.time() - start
+
+    statistics = json.loads(req.urlopen(url + "/stats").read().decode('utf-8'))
+    statistics['client_throughput'] = len(results) / elapsed if elapsed > 0 else 0.
+    server.shutdown()
+
+    return statistics
+
+
+
+""" EXECUTION """
+
+def run(args):
+    """Executes the main process of the script
+
+    Parameters
+    ----------
+    args : ArgumentParser
+        The arguments of the command typed by the user
+    """
+    global CONFIG
+    CONFIG = exh.load_json("config/{0}.json".format(args.CONFIG))
+
+    service = ScoringService(args.batch_size, args.batch_wait / 1000)
+
+    if args.replay is not None:
+        statistics = replay(service, args.replay, args.clients)
+        display.display_info(json.dumps(statistics))
+    elif args.http is not None:
+        server = ThreadingHTTPServer(("127.0.0.1", args.http), make_handler(service))
+        display.display_info("Serving on http://127.0.0.1:{0}".format(args.http))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        display.display_info(json.dumps(service.statistics.summary()))
+    else:
+        serve_stdin(service)
+        print(json.dumps(service.statistics.summary()), file=sys.stderr)
+
+if __name__ == "__main__":
+    args = check_args(sys.argv)
+    run(args)
@@ -1,9 +1,11 @@
 import argparse
+import os
 import sys
 
 import numpy as np
 
 from copy import deepcopy
+from scipy import sparse
 
 import display
 import explorer_helper as exh
@@ -13,10 +15,12 @@ CONFIG = None
 
 DIRECTORY = "wordsclustering"
 FILENAME_TEMPLATE = "documents/{0}.json"
+CHECKPOINT_FILENAME = DIRECTORY + "/{0}.checkpoint.npz"
 
 W = []
 Pw = dict()
 Ndw = dict()
+Ndw_pmids = dict()
 Pcw = None
 Ncw = None
 n_docs = []
@@ -39,101 +43,102 @@ def check_args(argv):
     parser = argparse.ArgumentParser(description="Searches the top words in a\
         publications file")
     parser.add_argument('CONFIG', type=str, help="the name of the configuration file (without extension)")
+    parser.add_argument('--resume', action='store_true', help="continues the IB \
+        method from its last checkpoint")
+    parser.add_argument('-p', '--processes', type=int, default=os.cpu_count(),
+        help="the number of processes running the restarts of the sequential IB method")
     args = parser.parse_args()
 
     return args
 
 """ FUNCTIONS """
-def save_clusters(clusters):
-    data = dict()
-    data['clusters'] = clusters
-    data['Ndw'] = Ndw
-    data['W'] = W
-
+def save_clusters(linkage=None, labels=None):
     directory = DIRECTORY + '/' + CONFIG['ALL_CLUSTERS_DIRECTORY']
     exh.create_directory(directory)
 
-    # filename = DIRECTORY + '/' + CONFIG['ALL_CLUSTERS_FILENAME']
-    filename = directory + "/ndw.json"
-    exh.write_json(Ndw, filename)
-
-    filename = directory + "/W.json"
-    exh.write_json(W, filename)
-
-    cluster_directory = directory + "/clusters"
-    exh.create_directory(cluster_directory)
-
-    for i, c in clusters.items():
-        filename = cluster_directory + "/{0}.json".format(i)
-        exh.write_json(c, filename)
+    # Number of occurrences of each word in each document, the documents of
+    # all categories being stacked, with the labels of the rows and columns
+    categories = CONFIG['CLUSTERING_CLASSES']
+    exh.write_sparse(sparse.vstack([Ndw[cat] for cat in categories], format='csr'), directory + "/ndw")
+    np.save(directory + "/pmids.npy", np.array([pmid for cat in categories for pmid in Ndw_pmids[cat]], dtype=str))
+    np.save(directory + "/categories.npy", np.array([cat for cat in categories for _ in Ndw_pmids[cat]], dtype=str))
+    np.save(directory + "/W.npy", np.array(W, dtype=str))
+
+    # Merge tree of the clusters, cut by ibmethod.cut for a number of
+    # clusters, or cluster of each word for each number of clusters of the
+    # sequential IB method, the files of the other method being removed
+    if linkage is not None:
+        np.save(directory + "/linkage.npy", linkage)
+        removed = ["labels.npy", "n_clusters.npy"]
+    else:
+        np.save(directory + "/labels.npy", labels)
+        np.save(directory + "/n_clusters.npy", np.array(CONFIG['SIB_N_CLUSTERS']))
+        removed = ["linkage.npy"]
+    for filename in removed:
+        if os.path.exists(directory + "/" + filename):
+            os.remove(directory + "/" + filename)
 
     display.display_info("Data clusters saved into " + directory)
 
 ''' WORDS INFORMATION EXTRACTION '''
 
 def extract_words_information(all_docs):
-    n_words = 0
+    # Ids of the words in order of first appearance
+    vocabulary = dict()
+    rows = dict()
+    cols = dict()
     for i in range(len(all_docs)):
         s = "Extracting words of documents set {0} / {1}".format(i+1, len(all_docs))
         print (s, end="\r")
         # print("Extract words of documents set {0} / {1}".format((i+1), len(all_docs)))
         # category = CLASSES[i]
         category = CONFIG['CLUSTERING_CLASSES'][i]
-        Ndw[category] = dict()
+        Ndw_pmids[category] = []
+        rows[category] = []
+        cols[category] = []
 
         for doc in all_docs[i]:
             pmid = doc['pmid']
-            Ndw[category][pmid] = dict()
-            for word in doc['text'].split(' '):
-                if not word in W:
-                    W.append(word)
-                    Pw[word] = 0
-                Pw[word] += 1
-
-                if not word in Ndw[category][pmid]:
-                    Ndw[category][pmid][word] = 0
-                Ndw[category][pmid][word] += 1
-                n_words += 1
+            words = doc['text'].split(' ')
+            rows[category].extend([len(Ndw_pmids[category])] * len(words))
+            cols[category].extend(vocabulary.setdefault(word, len(vocabulary)) for word in words)
+            Ndw_pmids[category].append(pmid)
 
     print(s)
 
-    W.sort()
-
-    for word in W:
-        Pw[word] = Pw[word] / n_words
+    W[:] = sorted(vocabulary)
 
+    # Ids of the words in the sorted vocabulary
+    index = {word: i for i, word in enumerate(W)}
+    rank = np.array([index[word] for word in vocabulary], dtype=int)
 
+    # Number of occurrences of each word in each document (documents x words),
+    # the occurrences of a word in a document being summed
+    n_occurrences = np.zeros(len(W), dtype=int)
+    for category in rows:
+        data = np.ones(len(cols[category]), dtype=np.int32)
+        shape = (len(Ndw_pmids[category]), len(W))
+        Ndw[category] = sparse.csr_matrix((data, (rows[category], rank[cols[category]])), shape=shape)
+        n_occurrences += np.asarray(Ndw[category].sum(axis=0)).ravel()
 
-''' JOIN PROBABILITY DISTRIBUTION '''
+    n_words = int(n_occurrences.sum())
+    for word, n in zip(W, n_occurrences.tolist()):
+        Pw[word] = n / n_words
 
-def word_occurences_in_category(category, word):
-    if Ncw[category][word] == 0:
-        tot = 0
-        cat_name = CONFIG['CLUSTERING_CLASSES'][category] #CLASSES[category]
-        w_label = W[word]
 
-        for doc_id in Ndw[cat_name]:
-            if w_label in Ndw[cat_name][doc_id]:
-                tot += Ndw[cat_name][doc_id][w_label]
-
-        Ncw[category][word] = tot + 0.5
-
-    return Ncw[category][word]
 
+''' JOIN PROBABILITY DISTRIBUTION '''
 
 def joint_probability_distribution():
     global Pcw, Ncw
 
-    n_c = len(CONFIG['CLUSTERING_CLASSES'])#len(CLASSES)
-    n_w = len(W)
-    Pcw = np.zeros((n_c, n_w))
-    Ncw = np.zeros((n_c, n_w))
+    # Number of occurrences of each word in each category, from the column
+    # sums of the documents x words matrices
+    Ncw = np.array([np.asarray(Ndw[cat_name].sum(axis=0)).ravel()
+        for cat_name in CONFIG['CLUSTERING_CLASSES']], dtype=float)
+    Ncw = Ncw + 0.5
 
-    for c in range(n_c):
-        for w in range(n_w):
-            Pcw[c, w] = word_occurences_in_category(c, w)
-
-    Pcw = Pcw / sum(sum(Pcw))
+    Pcw = Ncw / sum(sum(Ncw))
 
 ''' EXECUTION '''
 
@@ -147,6 +152,8 @@ def run(args):
     """
     global CONFIG
     CONFIG = exh.load_json("config/{0}.json".format(args.CONFIG))
+    if not CONFIG['IB_METHOD'] in ["agglomerative", "sequential"]:
+        raise ValueError("Unknown IB_METHOD {0} (agglomerative or sequential)".format(CONFIG['IB_METHOD']))
 
     exh.create_directory(DIRECTORY)
 
@@ -168,11 +175,27 @@ def run(args):
     joint_probability_distribution()
     display.display_ok("Computing joint probability distribution done")
 
+    if CONFIG['IB_METHOD'] == "sequential":
+        print("Starting sequential IB method")
+        labels = ib.sequential_cluster(Pcw, Pw, CONFIG['SIB_N_CLUSTERS'], CONFIG['SIB_RESTARTS'],
+            CONFIG['SIB_SEED'], CONFIG['SIB_MAX_ITERATIONS'], args.processes)
+        display.display_ok("Sequential IB method finished")
+        save_clusters(labels=labels)
+        return
+
     print("Starting IB method")
-    all_clusters = ib.cluster(deepcopy(Pcw), deepcopy(Pw))
+    dtype = np.float32 if CONFIG['IB_FLOAT32'] else np.float64
+    checkpoint = None
+    if CONFIG['IB_CHECKPOINT_MERGES'] is not None or CONFIG['IB_CHECKPOINT_MINUTES'] is not None:
+        checkpoint = CHECKPOINT_FILENAME.format(CONFIG['ALL_CLUSTERS_DIRECTORY'])
+    linkage = ib.cluster(deepcopy(Pcw), deepcopy(Pw), dtype, CONFIG['IB_MEMMAP_DIRECTORY'],
+        CONFIG['IB_NEIGHBOURS'], checkpoint, CONFIG['IB_CHECKPOINT_MERGES'],
+        CONFIG['IB_CHECKPOINT_MINUTES'], args.resume)
     display.display_ok("IB method finished")
 
-    save_clusters(all_clusters)
+    save_clusters(linkage)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
 
 if __name__ == "__main__":
     args = check_args(sys.argv)
@@ -1,4 +1,5 @@
 import argparse
+import os
 import sys
 
 import numpy as np
@@ -8,6 +9,7 @@ from copy import deepcopy
 import converter
 import display
 import explorer_helper as exh
+import ibmethod as ib
 import plotter as plt
 
 from classifiers.wordsclustering import NaiveBayesCluster
@@ -69,7 +71,7 @@ def save_to_log(results, model, key):
 
     exh.write_json(data, LOG_FILENAME.format(model))
 
-def classification(docs, Ndw, W, directory, true_predictions):
+def classification(docs, Ndw, categories, W, directory, true_predictions):
     strict_result = {
         "n_clusters": [],
         "tn": [],
@@ -88,29 +90,34 @@ def classification(docs, Ndw, W, directory, true_predictions):
     }
 
     print("Documents replacement")
-    converted_docs = converter.init(deepcopy(docs), deepcopy(W))
+    converted_docs = converter.init(docs, W)
     display.display_ok("Documents replacement done")
 
-    clusters_directory = directory + "/clusters"
     max_clusters = len(W)
+    if os.path.exists(directory + "/linkage.npy"):
+        # Cuts of the merge tree of the Agglomerative IB method
+        linkage = np.load(directory + "/linkage.npy")
+        a = [1,2,3,4,5,6,7,8,9,10]
+        a.extend(range(100,8500,100))
+        a.extend([8417])
+        partitions = ((n_clusters, ib.cut(linkage, n_clusters)) for n_clusters in a)
+    else:
+        # Partitions of the sequential IB method
+        labels = np.load(directory + "/labels.npy")
+        numbers = np.load(directory + "/n_clusters.npy")
+        partitions = ((int(n), ib.partition(l)) for n, l in zip(numbers, labels))
 
     print("Evaluating classifier")
-    a = [1,2,3,4,5,6,7,8,9,10]
-    a.extend(range(100,8500,100))
-    a.extend([8417])
-    for n_clusters in a:#range(1, max_clusters+1,100):
+    for n_clusters, clusters in partitions:
         print("Processing for {0} clusters (Total : {1})".format(n_clusters, max_clusters))
 
-        # Load clusters
-        clusters = exh.load_json(clusters_directory + "/{0}.json".format(n_clusters))
-
         # Prepare classifier
-        classifier = NaiveBayesCluster(deepcopy(clusters), deepcopy(Ndw), deepcopy(W))
+        classifier = NaiveBayesCluster(clusters, Ndw, categories)
         print("Classifier ready")
 
         print("Converting documents")
-        strict_converted_docs = converter.convert_all(deepcopy(converted_docs), deepcopy(clusters))
-        doublon_converted_docs = converter.convert_all(deepcopy(converted_docs), deepcopy(clusters), method='d')
+        strict_converted_docs = converter.convert_all(deepcopy(converted_docs), clusters)
+        doublon_converted_docs = converter.convert_all(deepcopy(converted_docs), clusters, method='d')
         print("Converting documents done")
 
         print("Evaluate Strict Predictions")
@@ -153,13 +160,16 @@ def run(args):
     display.display_ok("Loading publications done")
 
     data_directory = DIRECTORY + '/' + CONFIG['ALL_CLUSTERS_DIRECTORY']
-    Ndw = exh.load_json(data_directory + "/ndw.json")
-    W = exh.load_json(data_directory + "/W.json")
+    # Words counts of each publication, memory-mapped once for all the
+    # numbers of clusters
+    Ndw = exh.load_sparse(data_directory + "/ndw")
+    categories = np.load(data_directory + "/categories.npy", mmap_mode='r')
+    W = np.load(data_directory + "/W.npy", mmap_mode='r').tolist()
 
     # Real labels of each publication
     # y_true = np.append(np.zeros(len(notdida_data)), np.ones(len(dida_data)))
     y_true = np.append(np.ones(len(dida_data)), np.zeros(len(notdida_data)))
-    strict_result, doublon_result = classification(docs, Ndw, W, data_directory, y_true)
+    strict_result, doublon_result = classification(docs, Ndw, categories, W, data_directory, y_true)
 
     plt.plot_confusion_matrix(strict_result, len(dida_data), len(notdida_data), "strict_", "n_clusters", "Number of clusters", DIRECTORY, step=1000)
     exh.save_to_log(strict_result, "strict", "n_clusters", LOG_FILENAME.format("strict"))
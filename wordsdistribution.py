@@ -15,6 +15,8 @@ folder (without the extension).
 import argparse
 import sys
 
+import numpy as np
+
 import display
 import explorer_helper as exh
 import ngrams_helper as ngh
@@ -56,6 +58,9 @@ def check_args(argv):
 def merge_ngrams(grams1, grams2):
     """Merge to list of n-grams by keeping their score in each class
 
+    Both lists are joined on the n-grams, with a score of 0 for the n-grams
+    missing in one of the classes.
+
     Parameters
     ----------
     grams1 : list
@@ -66,28 +71,31 @@ def merge_ngrams(grams1, grams2):
     Returns
     -------
     dict
-        a dict object containing the score of each n-gram in each class
+        a dict object in which the 'grams' key gives the array of merged
+        n-grams, in order of first appearance, and the name of each class gives
+        the array of the scores of these n-grams in this class
     """
     print("Merging n-grams")
-    merged = dict()
     dida = CONFIG['DIDA_DOCS']
     notdida = CONFIG['NOTDIDA_DOCS']
+    n_grams1 = len(grams1)
+
+    keys = np.array([gram[0] for gram in grams1] + [gram[0] for gram in grams2], dtype=str)
+    values = np.array([gram[1] for gram in grams1] + [gram[1] for gram in grams2], dtype=float)
+
+    # Ids of the n-grams, numbered by order of first appearance
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    appearance = np.argsort(first, kind='mergesort')
+    rank = np.empty_like(appearance)
+    rank[appearance] = np.arange(len(appearance))
+    ids = rank[inverse.ravel()]
 
-    for gram in grams1:
-        if not gram[0] in merged:
-            # Create the gram
-            merged[gram[0]] = dict()
-            merged[gram[0]][dida] = gram[1]
-            # Prepare value for notDIDA
-            merged[gram[0]][notdida] = 0
-
-    for gram in grams2:
-        if not gram[0] in merged:
-            # Create the gram
-            merged[gram[0]] = dict()
-            # Value is 0 for DIDA because gram was not in grams1
-            merged[gram[0]][dida] = 0
-        merged[gram[0]][notdida] = gram[1]
+    merged = dict()
+    merged['grams'] = keys[first[appearance]]
+    merged[dida] = np.zeros(len(appearance))
+    merged[dida][ids[:n_grams1]] = values[:n_grams1]
+    merged[notdida] = np.zeros(len(appearance))
+    merged[notdida][ids[n_grams1:]] = values[n_grams1:]
 
     display.display_ok("Merging done")
 
@@ -99,22 +107,27 @@ def ordered(merged, f_score):
     Parameters
     ----------
     merged : dict
-        The dict containing n-grams and their score for each class
+        The dict containing n-grams and their score for each class as returned
+        by merge_ngrams
     f_score : function
-        The score function to use to order n-grams
+        The score function to use to order n-grams, applied on the arrays of
+        scores of both classes
 
     Returns
     -------
-    list
-        the ordered list of n-grams
+    dict
+        the dict containing the n-grams and their score for each class, ordered
+        by decreasing score
     """
     print("Ordering grams")
 
     dida = CONFIG['DIDA_DOCS']
     notdida = CONFIG['NOTDIDA_DOCS']
 
-    merged = sorted(merged.items(), key=lambda kv: f_score(kv[1][dida], kv[1][notdida]))
-    merged.reverse()
+    scores = f_score(merged[dida], merged[notdida])
+    # Stable sort reversed, as the n-grams were previously sorted
+    order = np.argsort(scores, kind='mergesort')[::-1]
+    merged = {key: values[order] for key, values in merged.items()}
 
     display.display_ok("Ordering done")
 
@@ -123,23 +136,31 @@ def ordered(merged, f_score):
 def save_to_file(merged, n):
     """Save a list of n-grams in a CSV file
 
+    The rows are written while they are produced and can be capped with the
+    DUMP_MAX_ROWS and DUMP_MIN_SUPPORT fields of the config file (the support
+    being the absolute value of the difference between both classes). The
+    file is compressed with gzip if DUMP_COMPRESS is set.
+
     Parameters
     ----------
-    merged : list
-        The list containing n-grams and their score for each class
+    merged : dict
+        The dict containing n-grams and their score for each class as returned
+        by ordered
     n : int
         The length of the n-grams
     """
     dida = CONFIG['DIDA_DOCS']
     notdida = CONFIG['NOTDIDA_DOCS']
 
-    l_merged = []
-    for word in merged:
-        ngram = "(" + word[0] + ")"
-        l_merged.append((ngram, word[1][dida], word[1][notdida], (word[1][dida] - word[1][notdida])))
+    diff = merged[dida] - merged[notdida]
+    l_merged = zip(("(" + gram + ")" for gram in merged['grams']), merged[dida].tolist(), merged[notdida].tolist(), diff.tolist())
+
+    filename = FILENAME.format(n)
+    if CONFIG['DUMP_COMPRESS']:
+        filename += ".gz"
 
-    exh.write_csv(l_merged, ["N-gram", "% DIDA", "% NotDIDA", "Diff"], FILENAME.format(n))
-    display.display_info("Results saved in " + FILENAME.format(n))
+    exh.stream_csv(l_merged, ["N-gram", "% DIDA", "% NotDIDA", "Diff"], filename, CONFIG['DUMP_MAX_ROWS'], CONFIG['DUMP_MIN_SUPPORT'], 3)
+    display.display_info("Results saved in " + filename)
 
 
 
@@ -150,14 +171,14 @@ def score(d, n):
 
     Parameters
     ----------
-    d : float
+    d : float or numpy.ndarray
         The DIDA score of a gram
-    n : float
+    n : float or numpy.ndarray
         The NotDIDA score of a gram
 
     Returns
     -------
-    float
+    float or numpy.ndarray
         the absolute value of the difference
     """
     return abs(d-n)
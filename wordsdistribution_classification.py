@@ -7,7 +7,11 @@ obtained by using the wordsdistribution.py script.
 It evaluates these models for each value of the threshold between 0 and X with
 a step equals to Y. X and Y corresponds to the values
 WORDS_DISTRIBUTION_MAX_THRESHOLD and WORDS_DISTRIBUTION_STEP_THRESHOLD defined
-in the config file.
+in the config file. All the thresholds are evaluated in a single pass, so small
+steps do not make the evaluation slower.
+
+The classifier having the best f1-score of each type is exported as a compact
+model in the `models` folder (see classifiers/wordsdistribution_model.py).
 
 The script can be run through the following command :
 `python wordsdistribution_classification.py CONFIG`
@@ -21,13 +25,13 @@ import sys
 import numpy as np
 
 from copy import deepcopy
-from sklearn.metrics import confusion_matrix, f1_score
 
 import display
 import explorer_helper as exh
 import plotter as plt
 
-from classifiers.wordsdistribution import StrictClassifier, SplitWeightedClassifier, WeightedClassifier
+from classifiers.wordsdistribution import WordsDistribution, StrictClassifier, SplitWeightedClassifier, WeightedClassifier
+from classifiers.wordsdistribution_model import export_model
 
 CONFIG = None
 
@@ -36,6 +40,7 @@ FILENAME_TEMPLATE = "documents/{0}.json"
 DISTRIBUTION_FILENAME_TEMPLATE = DIRECTORY + "/{0}-grams.csv"
 FSCORE_FILENAME = DIRECTORY + "/fscore.png"
 LOG_FILENAME = DIRECTORY + "/{0}.json"
+MODEL_DIRECTORY = DIRECTORY + "/models/{0}"
 
 
 
@@ -81,9 +86,36 @@ def csv_filenames(n):
     names = []
     for i in range(1, n+1):
         name = DISTRIBUTION_FILENAME_TEMPLATE.format(i)
+        if CONFIG['DUMP_COMPRESS']:
+            name += ".gz"
         names.append(name)
     return names
 
+def save_model(Classifier, distribution, results, model):
+    """Exports the classifier having the best f1-score as a compact model
+
+    Parameters
+    ----------
+    Classifier : Classifier
+        The type of the classifier
+    distribution : WordsDistribution
+        The words distribution loaded from the CSV files
+    results : dict
+        The results of the classifier for different value of the threshold
+    model : str
+        The prefix string of the classifier
+    """
+    best = int(np.argmax(results['score']))
+    threshold = results['threshold'][best]
+    classifier = Classifier(threshold, distribution, CONFIG['DIDA_DOCS'], CONFIG['NOTDIDA_DOCS'])
+
+    metadata = {
+        "score": float(results['score'][best]),
+        "ngrams": CONFIG['NGRAMS']
+    }
+    export_model(classifier, MODEL_DIRECTORY.format(model), metadata)
+    display.display_info("Model with threshold {0} saved in {1}".format(threshold, MODEL_DIRECTORY.format(model)))
+
 def save_to_log(results, model, key):
     """Saves the evolution of the confusion matrix and the f1-score in JSON file
 
@@ -105,20 +137,50 @@ def save_to_log(results, model, key):
 
     exh.write_json(data, LOG_FILENAME.format(model))
 
-def train(Classifier, data, csv_files, y_true):
+def train(Classifier, data, distribution, y_true):
     """Trains a classifier with a range of thresholds based on words distribution
 
+    All the thresholds are evaluated in a single pass: as the selected n-grams
+    only grow when the threshold decreases, the scores of the publications are
+    cumulative sums along the n-grams sorted by decreasing difference.
+
     Parameters
     ----------
     Classifier : Classifier
         The type of classifier to train
     data : list
         The list of publications composing the data set
-    csv_files : list
-        The list of CSV files containing the words distribution
+    distribution : WordsDistribution
+        The words distribution loaded from the CSV files
     y_true : list
         The list of the true classes of each publication in the training set
 
+    Returns
+    -------
+    dict
+        the evolutions of the confusion matrix and the list of all evaluated
+        threshold
+    """
+    # N-grams of the distribution present in each publication
+    presence = distribution.presence_matrix(data)
+
+    return evaluate(Classifier, presence, distribution, y_true)
+
+def evaluate(Classifier, presence, distribution, y_true):
+    """Evaluates a classifier for each threshold in a single pass
+
+    Parameters
+    ----------
+    Classifier : Classifier
+        The type of classifier to evaluate
+    presence : scipy.sparse.csr_matrix
+        The n-grams of the distribution present in each publication, as
+        returned by WordsDistribution.presence_matrix
+    distribution : WordsDistribution
+        The words distribution
+    y_true : list
+        The list of the true classes of each publication
+
     Returns
     -------
     dict
@@ -130,44 +192,35 @@ def train(Classifier, data, csv_files, y_true):
     step = CONFIG['WORDS_DISTRIBUTION_STEP_THRESHOLD']
 
     threshold_l = []
-    tn_l = []
-    fp_l = []
-    fn_l = []
-    tp_l = []
-    score_l = []
-
     while threshold > 0:
-        s = "Threshold {0} ({1} %)".format(threshold, int(((max_threshold-threshold)/max_threshold)*100))
-        print (s, end="\r")
-
-        # Initialize the classifier
-        classifier = Classifier(threshold, csv_files, CONFIG['DIDA_DOCS'], CONFIG['NOTDIDA_DOCS'])
+        threshold_l.append(threshold)
+        threshold -= step
 
-        # Predict the class of each publication
-        y_pred = classifier.predict(data)
+    # Initialize the classifier with the lowest threshold
+    classifier = Classifier(threshold_l[-1], distribution, CONFIG['DIDA_DOCS'], CONFIG['NOTDIDA_DOCS'])
 
-        # Confusion matrix of the predictions
-        tn, fp, fn, tp = confusion_matrix(y_true, y_pred).ravel()
-        # F1-score of the classifier
-        score = f1_score(y_true, y_pred)
+    # Predict the class of each publication for each threshold
+    c1_scores, c2_scores = classifier.cumulative_scores(presence, threshold_l)
+    y_pred = c1_scores >= c2_scores
 
-        threshold_l.append(threshold)
-        tn_l.append(tn)
-        fp_l.append(fp)
-        fn_l.append(fn)
-        tp_l.append(tp)
-        score_l.append(score)
+    # Confusion matrices of the predictions
+    y = np.asarray(y_true, dtype=bool)[:, np.newaxis]
+    tp_l = np.count_nonzero(y_pred & y, axis=0)
+    fp_l = np.count_nonzero(y_pred & ~y, axis=0)
+    fn_l = np.count_nonzero(~y_pred & y, axis=0)
+    tn_l = np.count_nonzero(~y_pred & ~y, axis=0)
 
-        threshold -= step
-    print("Threshold 1 (100 %)")
+    # F1-scores of the classifier
+    denominator = 2 * tp_l + fp_l + fn_l
+    score_l = np.where(denominator > 0, 2 * tp_l / np.maximum(denominator, 1), 0.)
 
     return {
         "threshold": threshold_l,
-        "tn": tn_l,
-        "fp": fp_l,
-        "fn": fn_l,
-        "tp": tp_l,
-        "score": score_l
+        "tn": list(tn_l),
+        "fp": list(fp_l),
+        "fn": list(fn_l),
+        "tp": list(tp_l),
+        "score": list(score_l)
     }
 
 
@@ -196,7 +249,9 @@ def run(args):
 
     n = CONFIG['NGRAMS']
 
-    csv_files = csv_filenames(n)
+    print("Loading words distribution")
+    distribution = WordsDistribution(csv_filenames(n))
+    display.display_ok("Loading words distribution done")
 
     # Real labels of each publication
     y_true = np.append(np.ones(len(dida_data)), np.zeros(len(notdida_data)))
@@ -208,26 +263,29 @@ def run(args):
     classifiers_names = []
 
     print("Strict Classifier training")
-    results = train(StrictClassifier, deepcopy(data), csv_files, y_true)
+    results = train(StrictClassifier, deepcopy(data), distribution, y_true)
     plt.plot_confusion_matrix(results, len(dida_data), len(notdida_data), 'strict_', "threshold", "Threshold", DIRECTORY)
     scores.append(results['score'])
     exh.save_to_log(results, "strict", "threshold", LOG_FILENAME.format("strict"))
+    save_model(StrictClassifier, distribution, results, "strict")
     classifiers_names.append("Strict Classifier")
     display.display_ok("Strict Classifier training done")
 
     print("Split Weighted Classifier training")
-    results = train(SplitWeightedClassifier, deepcopy(data), csv_files, y_true)
+    results = train(SplitWeightedClassifier, deepcopy(data), distribution, y_true)
     plt.plot_confusion_matrix(results, len(dida_data), len(notdida_data), 'splitweighted_', "threshold", "Threshold", DIRECTORY)
     scores.append(results['score'])
     exh.save_to_log(results, "splitweighted", "threshold", LOG_FILENAME.format("splitweighted"))
+    save_model(SplitWeightedClassifier, distribution, results, "splitweighted")
     classifiers_names.append("Split Weighted Classifier")
     display.display_ok("Split Weighted Classifier training done")
 
     print("Weighted Classifier training")
-    results = train(WeightedClassifier, deepcopy(data), csv_files, y_true)
+    results = train(WeightedClassifier, deepcopy(data), distribution, y_true)
     plt.plot_confusion_matrix(results, len(dida_data), len(notdida_data), 'weighted_', "threshold", "Threshold", DIRECTORY)
     scores.append(results['score'])
     exh.save_to_log(results, "weighted", "threshold", LOG_FILENAME.format("weighted"))
+    save_model(WeightedClassifier, distribution, results, "weighted")
     classifiers_names.append("Weighted Classifier")
     display.display_ok("Weighted Classifier training done")
 